@@ -0,0 +1,154 @@
+"""Worker cold start and database connection reuse per config.
+
+    python benchmarks/bench_app.py --starts 5 --threads 16 --requests 50
+    python benchmarks/bench_app.py --database-url postgresql://...
+
+Cold start runs `import project`, `create_app(config)` and a first webhook
+delivery in fresh interpreters, as a gunicorn worker would. Connection
+reuse then serves `--requests` database-backed requests from each of
+`--threads` threads per config and reports connections opened per
+checkout and checkout latency. SQLite file databases always use NullPool
+(one connection per checkout); pool settings show on Postgres.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+from fake_graph import FakeGraph  # noqa: E402
+
+CONFIGS = ('config.DevelopmentConfig', 'config.ProductionConfig')
+DELIVERY = json.dumps({'object': 'page', 'entry': [{'messaging': [{
+    'sender': {'id': 'cold-start'}, 'timestamp': 1,
+    'postback': {'title': 'Chats hoy', 'payload': 'True'}}]}]})
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+def child(config):
+    """Time one worker start and print it as JSON."""
+    started = time.perf_counter()
+    import project
+    imported = time.perf_counter()
+    app = project.create_app(config)
+    created = time.perf_counter()
+    response = app.test_client().post('/', data=DELIVERY,
+                                      content_type='application/json')
+    assert response.status_code == 200, response.status_code
+    print(json.dumps({
+        'import': imported - started,
+        'create_app': created - imported,
+        'first_request': time.perf_counter() - created,
+    }))
+
+
+def cold_start(config, starts):
+    samples = []
+    for _ in range(starts):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', config])
+        samples.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+    return dict((name, percentile([sample[name] for sample in samples], 50))
+                for name in ('import', 'create_app', 'first_request'))
+
+
+def connection_reuse(config, threads, requests):
+    from sqlalchemy import event, text
+    from project import create_app, db
+    app = create_app(config)
+    counts = {'connect': 0, 'checkout': 0}
+    lock = threading.Lock()
+    latencies = []
+
+    def count(name):
+        def listener(*args):
+            with lock:
+                counts[name] += 1
+        return listener
+
+    with app.app_context():
+        for name in counts:
+            event.listen(db.engine, name, count(name))
+
+    def serve():
+        for _ in range(requests):
+            started = time.perf_counter()
+            # One request: a short query, session removed on teardown
+            with app.app_context():
+                db.session.execute(text('SELECT 1'))
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=serve) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    with app.app_context():
+        pool = db.engine.pool
+    return {
+        'pool': type(pool).__name__,
+        'connects': counts['connect'],
+        'checkouts': counts['checkout'],
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'rps': len(latencies) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--starts', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--database-url')
+    parser.add_argument('--child')
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+    graph = FakeGraph().start()
+    os.environ.setdefault('PAGE_ACCESS_TOKEN', 'benchmark')
+    os.environ['LOG_SAMPLE_RATE'] = '0'
+    os.environ['GRAPH_API_URL'] = graph.url
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///{0}'.format(
+        os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    from project import create_app, db
+    with create_app(CONFIGS[0]).app_context():
+        db.create_all()
+
+    print('{0:<26} {1:>10} {2:>12} {3:>15}'.format(
+        'cold start (p50)', 'import ms', 'create_app ms', 'first request ms'))
+    for config in CONFIGS:
+        times = cold_start(config, args.starts)
+        print('{0:<26} {1:>10.1f} {2:>12.1f} {3:>15.1f}'.format(
+            config.split('.')[-1], times['import'] * 1000,
+            times['create_app'] * 1000, times['first_request'] * 1000))
+    print()
+    print('{0:<26} {1:>10} {2:>9} {3:>9} {4:>8} {5:>8} {6:>8}'.format(
+        'connection reuse', 'pool', 'connects', 'checkouts', 'p50 ms',
+        'p99 ms', 'req/s'))
+    for config in CONFIGS:
+        result = connection_reuse(config, args.threads, args.requests)
+        print('{0:<26} {pool:>10} {connects:>9} {checkouts:>9} '
+              '{1:>8.2f} {2:>8.2f} {rps:>8.0f}'.format(
+                  config.split('.')[-1], result['p50'] * 1000,
+                  result['p99'] * 1000, **result))
+    graph.stop()
+
+
+if __name__ == '__main__':
+    main()
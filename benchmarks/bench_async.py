@@ -0,0 +1,64 @@
+"""fb.Bot vs fb_async.AsyncBot against the local fake Graph API.
+
+    python benchmarks/bench_async.py --messages 500 --latency 0.05
+
+Also checks that both clients produce the same Send API payloads.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_graph import FakeGraph  # noqa: E402
+from fb import Bot  # noqa: E402
+from fb_async import AsyncBot  # noqa: E402
+
+
+async def send_all(bot, messages):
+    async with bot:
+        await bot.send_action('0', 'typing_on')
+        profile = await bot.get_user_info('0')
+        assert profile['id'] == '0', profile
+        return await asyncio.gather(*[
+            bot.send_text_message(str(i), 'hola') for i in range(messages)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+    with FakeGraph(latency=args.latency) as graph:
+        bot = Bot('benchmark', graph_url=graph.url)
+        started = time.perf_counter()
+        for i in range(args.messages):
+            bot.send_text_message(str(i), 'hola')
+        sync_elapsed = time.perf_counter() - started
+        sync_sent = list(graph.sent)
+        del graph.sent[:]
+
+        async_bot = AsyncBot('benchmark', graph_url=graph.url,
+                             max_concurrency=args.concurrency)
+        started = time.perf_counter()
+        results = asyncio.get_event_loop().run_until_complete(
+            send_all(async_bot, args.messages))
+        async_elapsed = time.perf_counter() - started
+        async_sent = [payload for payload in graph.sent
+                      if 'message' in payload]
+
+    def key(payload):
+        return json.dumps(payload, sort_keys=True)
+    assert sorted(map(key, sync_sent)) == sorted(map(key, async_sent))
+    assert all('message_id' in result for result in results)
+    print('Bot: {0:.3f}s  AsyncBot: {1:.3f}s  ({2} messages, {3}s latency)'
+          .format(sync_elapsed, async_elapsed, args.messages, args.latency))
+
+
+if __name__ == '__main__':
+    main()
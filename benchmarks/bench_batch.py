@@ -0,0 +1,42 @@
+"""Sequential send_text_message vs Graph batch requests on a fake Graph API.
+
+    python benchmarks/bench_batch.py --messages 200 --latency 0.02
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_graph import FakeGraph  # noqa: E402
+from fb import Bot  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    with FakeGraph(latency=args.latency,
+                   error_rate=args.error_rate) as graph:
+        bot = Bot('benchmark', graph_url=graph.url)
+        started = time.perf_counter()
+        for i in range(args.messages):
+            bot.send_text_message(str(i), 'hola')
+        sequential = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with bot.batch() as batch:
+            for i in range(args.messages):
+                batch.send_text_message(str(i), 'hola')
+        batched = time.perf_counter() - started
+        failed = sum(1 for result in batch.results if 'error' in result)
+    print('sequential: {0:.3f}s  batched: {1:.3f}s  failed items: {2}'.format(
+        sequential, batched, failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Bytes per send and encode time for Send API payloads.
+
+    python benchmarks/bench_encoding.py
+
+Compares the previous encoding (default separators, recursive attr.asdict
+in the encoder) with fb.dumps and a pre-serialized fb.MessageTemplate.
+"""
+import json
+import os
+import sys
+import timeit
+
+import attr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PAGE_ACCESS_TOKEN', 'benchmark')
+
+from fb import (  # noqa: E402
+    AttrsEncoder, MessageTemplate, NotificationType, dumps, generic_template)
+from project.views import get_reports  # noqa: E402
+
+NUMBER = 20000
+
+
+class AsdictEncoder(json.JSONEncoder):
+    """The encoder fb.Bot used before, kept here for comparison."""
+
+    def default(self, obj):
+        if hasattr(obj, '__attrs_attrs__'):
+            return {k: v for k, v in attr.asdict(obj).items()
+                    if v is not None}
+        return json.JSONEncoder.default(self, obj)
+
+
+@attr.s
+class Button(object):
+    type = attr.ib()
+    title = attr.ib()
+    payload = attr.ib(default=None)
+    url = attr.ib(default=None)
+
+
+@attr.s
+class Element(object):
+    title = attr.ib()
+    subtitle = attr.ib(default=None)
+    image_url = attr.ib(default=None)
+    buttons = attr.ib(default=None)
+
+
+def payload(recipient_id, message):
+    return {'recipient': {'id': recipient_id}, 'message': message,
+            'notification_type': NotificationType.regular.value}
+
+
+def report(name, func):
+    seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+    size = len(func())
+    print('  {0:<28} {1:6d} bytes {2:8.2f}us/send'.format(
+        name, size, seconds / NUMBER * 1e6))
+
+
+def main():
+    recipient_id = '1234567890123456'
+    reports = generic_template(get_reports())
+    template = MessageTemplate(reports)
+    print('Reportes: generic template')
+    report('json.dumps (before)', lambda: json.dumps(
+        payload(recipient_id, reports), cls=AttrsEncoder).encode('utf8'))
+    report('fb.dumps', lambda: dumps(payload(recipient_id, reports)))
+    report('MessageTemplate.render', lambda: template.render(recipient_id))
+
+    elements = generic_template([
+        Element('Despacito', 'Luis Fonsi', buttons=[
+            Button('postback', 'Agregar canción', str(track_id))])
+        for track_id in range(3)])
+    print('attrs elements')
+    report('asdict encoder (before)', lambda: json.dumps(
+        payload(recipient_id, elements), cls=AsdictEncoder).encode('utf8'))
+    report('fb.dumps', lambda: dumps(payload(recipient_id, elements)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Latency of the favorites upsert as the `favorites` table grows.
+
+    python benchmarks/bench_favorites.py --sizes 1000,100000,10000000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('PAGE_ACCESS_TOKEN', 'benchmark')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///{0}'.format(
+    os.path.join(tempfile.mkdtemp(), 'bench_favorites.db')))
+
+from project import create_app, db  # noqa: E402
+from project.favorites import add_favorite, is_favorite  # noqa: E402
+from project.models import Song, User, favorites  # noqa: E402
+
+FAVORITES_PER_USER = 100
+SONGS = 10000
+CHUNK = 10000
+
+
+def populate(start, stop):
+    """Grow the table to `stop` favorites, 100 songs per user."""
+    users = []
+    rows = []
+    for n in range(start, stop):
+        user_id, k = divmod(n, FAVORITES_PER_USER)
+        if k == 0:
+            users.append({'recipient_id': 'u{0}'.format(user_id),
+                          'first_name': 'bench', 'last_name': 'user'})
+        rows.append({
+            'users_recipient_id': 'u{0}'.format(user_id),
+            'songs_track_id': 's{0}'.format((user_id * 7 + k) % SONGS)})
+        if len(rows) == CHUNK:
+            flush(users, rows)
+            users, rows = [], []
+    flush(users, rows)
+
+
+def flush(users, rows):
+    if users:
+        db.session.execute(User.__table__.insert(), users)
+    if rows:
+        db.session.execute(favorites.insert(), rows)
+    db.session.commit()
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+def measure(size, operations):
+    new, existing, lookups = [], [], []
+    for i in range(operations):
+        user_id = 'u{0}'.format(i * 97 % (size // FAVORITES_PER_USER))
+        track_id = 's{0}'.format(SONGS + i)
+        db.session.execute(Song.__table__.insert(), {
+            'track_id': track_id, 'track_name': 'new', 'artist_name': 'new',
+            'searched_times': 1})
+        for samples in (new, existing):
+            started = time.perf_counter()
+            add_favorite(user_id, track_id)
+            db.session.commit()
+            samples.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        is_favorite(user_id, track_id)
+        lookups.append(time.perf_counter() - started)
+    track_ids = ['s{0}'.format(SONGS + i) for i in range(operations)]
+    db.session.execute(favorites.delete().where(
+        favorites.c.songs_track_id.in_(track_ids)))
+    db.session.execute(Song.__table__.delete().where(
+        Song.track_id.in_(track_ids)))
+    db.session.commit()
+    for name, samples in (('insert', new), ('bump', existing),
+                          ('lookup', lookups)):
+        print('{0:>10} {1:>7} p50={2:8.3f}ms p99={3:8.3f}ms'.format(
+            size, name, percentile(samples, 50) * 1000,
+            percentile(samples, 99) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000,'
+                                           '10000000')
+    parser.add_argument('--operations', type=int, default=500)
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.execute(Song.__table__.insert(), [{
+            'track_id': 's{0}'.format(i), 'track_name': 'song',
+            'artist_name': 'artist', 'searched_times': 1}
+            for i in range(SONGS)])
+        db.session.commit()
+        current = 0
+        for size in sizes:
+            populate(current, size)
+            current = size
+            measure(size, args.operations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Per-request cost of verifying webhook signatures on the raw body.
+
+    python benchmarks/bench_signature.py --sizes 1024,65536,1048576
+"""
+import argparse
+import hashlib
+import hmac
+import io
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fb import PayloadTooLarge, read_signed_payload  # noqa: E402
+
+APP_SECRET = 'benchmark-secret'
+MAX_LENGTH = 1024 * 1024
+
+
+def webhook_body(size):
+    message = {'sender': {'id': '1234567890'},
+               'message': {'text': 'buscar: despacito'}}
+    item_size = len(json.dumps(message)) + 2
+    messaging = [message] * max(1, (size - 64) // item_size)
+    return json.dumps({'object': 'page',
+                       'entry': [{'messaging': messaging}]}).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1024,65536,1048576')
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+    for size in (int(size) for size in args.sizes.split(',')):
+        body = webhook_body(size)
+        header = 'sha256=' + hmac.new(APP_SECRET.encode('utf8'), body,
+                                      hashlib.sha256).hexdigest()
+        forged = 'sha256=' + '0' * 64
+
+        def parse_only():
+            json.loads(body.decode('utf-8'))
+
+        def verify_and_parse():
+            json.loads(read_signed_payload(
+                APP_SECRET, io.BytesIO(body), header,
+                MAX_LENGTH).decode('utf-8'))
+
+        def reject_forged():
+            assert read_signed_payload(
+                APP_SECRET, io.BytesIO(body), forged, MAX_LENGTH) is None
+
+        def reject_oversized():
+            try:
+                read_signed_payload(APP_SECRET, io.BytesIO(body * 2), header,
+                                    len(body))
+            except PayloadTooLarge:
+                pass
+
+        print('{0:>9} bytes'.format(len(body)))
+        for name, func in (('parse only', parse_only),
+                           ('verify + parse', verify_and_parse),
+                           ('reject forged', reject_forged),
+                           ('reject oversized', reject_oversized)):
+            seconds = min(timeit.repeat(func, number=args.number, repeat=3))
+            print('  {0:<17} {1:9.1f}us/request'.format(
+                name, seconds / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
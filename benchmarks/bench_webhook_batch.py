@@ -0,0 +1,77 @@
+"""Per-event vs batched handling of multi-event webhook deliveries.
+
+    python benchmarks/bench_webhook_batch.py --sizes 1,10,50 --deliveries 5
+
+Posts deliveries of 'Agregar canción' postbacks from distinct senders to
+the app (in-process, against local Graph and Musixmatch fakes) with
+WEBHOOK_BATCH off and on, and reports events per second.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+from fake_graph import FakeGraph  # noqa: E402
+from fake_musixmatch import FakeMusixmatch  # noqa: E402
+
+
+def delivery(size, offset):
+    return json.dumps({'object': 'page', 'entry': [{
+        'id': 'PAGE_ID',
+        'messaging': [{
+            'sender': {'id': 'sender-{0}'.format(offset + i)},
+            'postback': {'title': 'Agregar canción',
+                         'payload': str(offset + i)},
+        } for i in range(size)],
+    }]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1,10,50')
+    parser.add_argument('--deliveries', type=int, default=5)
+    parser.add_argument('--graph-latency', type=float, default=0.02)
+    parser.add_argument('--musixmatch-latency', type=float, default=0.05)
+    args = parser.parse_args()
+    graph = FakeGraph(latency=args.graph_latency).start()
+    musixmatch = FakeMusixmatch(latency=args.musixmatch_latency).start()
+    os.environ.setdefault('PAGE_ACCESS_TOKEN', 'benchmark')
+    os.environ['LOG_SAMPLE_RATE'] = '0'
+    os.environ['GRAPH_API_URL'] = graph.url
+    os.environ['MUSIXMATCH_API_URL'] = musixmatch.url
+    os.environ['DATABASE_URL'] = 'sqlite:///{0}'.format(
+        os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    from project import create_app, db
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+
+    offset = 0
+    print('{0:>6} {1:>14} {2:>14}'.format('events', 'per-event/s', 'batched/s'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        rates = []
+        for batch in (False, True):
+            app.config['WEBHOOK_BATCH'] = batch
+            started = time.perf_counter()
+            for _ in range(args.deliveries):
+                response = client.post(
+                    '/', data=delivery(size, offset),
+                    content_type='application/json')
+                assert response.status_code == 200, response.status_code
+                offset += size
+            rates.append(size * args.deliveries /
+                         (time.perf_counter() - started))
+        print('{0:>6} {1:>14.1f} {2:>14.1f}'.format(size, *rates))
+    graph.stop()
+    musixmatch.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Local stand-in for the Graph API used by benchmarks and manual tests.
+
+    python benchmarks/fake_graph.py --port 8081 --latency 0.05
+
+Point a Bot at it with `Bot(token, graph_url='http://127.0.0.1:8081/v2.6')`.
+Supported: POST me/messages, POST me/message_attachments, batch requests on
+the version root, GET <user id> profiles and POST me/messenger_profile.
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+from six.moves import socketserver
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.urllib.parse import parse_qs, urlparse
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeGraph(object):
+    """Threaded fake Graph API server with latency and error injection."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 api_version='2.6'):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.api_version = api_version
+        self.sent = []
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}/v{2}'.format(host, port, self.api_version)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method, path, params):
+        """Returns (status code, response <dict>) for one Graph call."""
+        with self._lock:
+            self.requests += 1
+            next_id = next(self._ids)
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {'error': {'message': 'Injected failure', 'code': 2}}
+        path = re.sub(r'^/?v[\d.]+/?', '', path).strip('/')
+        if method == 'POST' and path == 'me/messages':
+            recipient = params.get('recipient') or {}
+            if not isinstance(recipient, dict):
+                recipient = json.loads(recipient)
+            with self._lock:
+                self.sent.append(params)
+            return 200, {'recipient_id': recipient.get('id'),
+                         'message_id': 'mid.{0}'.format(next_id)}
+        if method == 'POST' and path == 'me/message_attachments':
+            return 200, {'attachment_id': str(next_id)}
+        if method == 'POST' and path == 'me/messenger_profile':
+            return 200, {'result': 'success'}
+        if method == 'GET' and path:
+            return 200, {'id': path, 'first_name': 'Fake',
+                         'last_name': 'User {0}'.format(path)}
+        return 404, {'error': {'message': 'Unknown path', 'code': 100}}
+
+    def handle_batch(self, batch):
+        items = []
+        for item in json.loads(batch):
+            body = dict((key, values[0]) for key, values in
+                        parse_qs(item.get('body', '')).items())
+            code, result = self.handle(item.get('method', 'GET'),
+                                       item.get('relative_url', ''), body)
+            items.append({'code': code, 'headers': [],
+                          'body': json.dumps(result)})
+        return 200, items
+
+    def _handler(self):
+        graph = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._respond('GET', {})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length)
+                content_type = self.headers.get('Content-Type') or ''
+                if content_type.startswith('application/json'):
+                    params = json.loads(raw.decode('utf-8') or '{}')
+                elif content_type.startswith('multipart/'):
+                    params = {}
+                else:
+                    params = dict((key, values[0]) for key, values in
+                                  parse_qs(raw.decode('utf-8')).items())
+                self._respond('POST', params)
+
+            def _respond(self, method, params):
+                if graph.latency:
+                    time.sleep(graph.latency)
+                path = urlparse(self.path).path
+                if (method == 'POST' and 'batch' in params and
+                        not path.strip('/').count('/')):
+                    code, body = graph.handle_batch(params['batch'])
+                else:
+                    code, body = graph.handle(method, path, params)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    graph = FakeGraph(args.host, args.port, args.latency, args.error_rate)
+    print('Fake Graph API listening on {0}'.format(graph.url))
+    graph.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
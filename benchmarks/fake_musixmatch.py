@@ -0,0 +1,124 @@
+"""Local stand-in for the Musixmatch API used by benchmarks.
+
+    python benchmarks/fake_musixmatch.py --port 8082 --latency 0.1
+
+Run the app with MUSIXMATCH_API_URL=http://127.0.0.1:8082/ws/1.1 to use
+it. Supports track.search and track.get with deterministic results.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from fake_graph import ThreadingHTTPServer
+
+
+class FakeMusixmatch(object):
+    """Threaded fake Musixmatch server with latency and error injection."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 results=10):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.results = results
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}/ws/1.1'.format(host, port)
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def track(self, track_id):
+        return {'track_id': int(track_id),
+                'track_name': 'Track {0}'.format(track_id),
+                'artist_name': 'Artist {0}'.format(int(track_id) % 97)}
+
+    def handle(self, method, params):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, {'message': {'header': {'status_code': 503}}}
+        if method == 'track.search':
+            query = params.get('q_track', '')
+            page_size = int(params.get('page_size', self.results))
+            page = int(params.get('page', 1))
+            seed = zlib.crc32(query.encode('utf-8')) % 100000
+            start = seed + (page - 1) * page_size
+            body = {'track_list': [
+                {'track': self.track(track_id)}
+                for track_id in range(start, start + min(
+                    page_size, max(0, self.results - (page - 1) * page_size)))
+            ]}
+        elif method == 'track.get':
+            body = {'track': self.track(params.get('track_id', 0))}
+        else:
+            return 404, {'message': {'header': {'status_code': 404}}}
+        return 200, {'message': {'header': {'status_code': 200},
+                                 'body': body}}
+
+    def _handler(self):
+        musixmatch = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if musixmatch.latency:
+                    time.sleep(musixmatch.latency)
+                url = urlparse(self.path)
+                params = dict((key, values[0]) for key, values in
+                              parse_qs(url.query).items())
+                code, body = musixmatch.handle(
+                    url.path.rstrip('/').rsplit('/', 1)[-1], params)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    musixmatch = FakeMusixmatch(args.host, args.port, args.latency,
+                                args.error_rate)
+    print('Fake Musixmatch API listening on {0}'.format(musixmatch.url))
+    musixmatch.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
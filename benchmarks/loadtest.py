@@ -0,0 +1,221 @@
+"""End-to-end webhook load test against local Graph and Musixmatch fakes.
+
+    python benchmarks/loadtest.py --rps 50 --duration 10 \
+        --graph-latency 0.05 --musixmatch-latency 0.1 \
+        --save benchmarks/results/baseline.json
+
+Replays the recorded deliveries in benchmarks/payloads/ (one scenario per
+file) against the Flask app served in-process at a fixed request rate and
+reports latency percentiles, throughput, errors and DB queries per
+request. `--compare` prints the change against a previously saved run.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+from fake_graph import FakeGraph  # noqa: E402
+from fake_musixmatch import FakeMusixmatch  # noqa: E402
+
+PAYLOADS = os.path.join(BENCHMARKS, 'payloads')
+SCENARIOS = ('buscar', 'ver_mas', 'agregar_cancion', 'reportes',
+             'lista_de_favoritos', 'mostrar_usuarios', 'chats_hoy')
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.count += 1
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+def render(template, sender_id, sequence):
+    # Unique mids and timestamps, or events are dropped as redeliveries
+    body = template.replace('SENDER_ID', sender_id).replace(
+        '"mid.', '"mid.{0}.'.format(sequence)).replace(
+            '"timestamp": 1530000000000',
+            '"timestamp": {0}'.format(1530000000000 + sequence))
+    return body.encode('utf-8')
+
+
+def start_app(args, graph, musixmatch):
+    """Configure the environment, import the app and serve it."""
+    os.environ.setdefault('PAGE_ACCESS_TOKEN', 'loadtest')
+    os.environ.setdefault('LOG_SAMPLE_RATE', '0')
+    os.environ['GRAPH_API_URL'] = graph.url
+    os.environ['MUSIXMATCH_API_URL'] = musixmatch.url
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///{0}'.format(
+        os.path.join(tempfile.mkdtemp(), 'loadtest.db'))
+    from sqlalchemy import event
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from project import create_app, db, start_workers
+
+    app = create_app()
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    counter = QueryCounter()
+    with app.app_context():
+        db.create_all()
+        event.listen(db.engine, 'before_cursor_execute', counter)
+    start_workers(app)
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return app, server, counter
+
+
+def run_scenario(name, url, app_secret, args, counter, graph, musixmatch):
+    with open(os.path.join(PAYLOADS, name + '.json')) as f:
+        template = f.read()
+    total = int(args.rps * args.duration)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def fire(sequence, scheduled):
+        delay = scheduled - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        body = render(template, 'loadtest-{0}'.format(
+            sequence % args.users), sequence)
+        headers = {'Content-Type': 'application/json'}
+        if app_secret:
+            headers['X-Hub-Signature-256'] = 'sha256=' + hmac.new(
+                app_secret.encode('utf8'), body, hashlib.sha256).hexdigest()
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            ok = session.post(url, data=body, headers=headers,
+                              timeout=30).status_code == 200
+        except requests.RequestException:
+            ok = False
+        # Measured from the scheduled start to avoid coordinated omission
+        elapsed = time.time() - scheduled
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+    queries_before = counter.count if counter else None
+    graph_before = graph.requests
+    musixmatch_before = sum(musixmatch.calls.values())
+    started = time.time() + 0.1
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for sequence in range(total):
+            executor.submit(fire, sequence, started + sequence / args.rps)
+    wall = time.time() - started
+    return {
+        'requests': total,
+        'errors': errors[0],
+        'throughput': total / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'db_queries_per_request': (
+            (counter.count - queries_before) / float(total)
+            if counter else None),
+        'graph_calls_per_request': (
+            (graph.requests - graph_before) / float(total)),
+        'musixmatch_calls_per_request': (
+            (sum(musixmatch.calls.values()) - musixmatch_before) /
+            float(total)),
+    }
+
+
+def compare(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)['scenarios']
+    print('\nChange against {0}'.format(previous_path))
+    for name, result in results.items():
+        before = previous.get(name)
+        if not before:
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput'):
+            if before.get(metric):
+                changes.append('{0} {1:+.1f}%'.format(
+                    metric, (result[metric] / before[metric] - 1) * 100))
+        print('  {0:<20} {1}'.format(name, '  '.join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--rps', type=float, default=20)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--graph-latency', type=float, default=0.05)
+    parser.add_argument('--graph-error-rate', type=float, default=0.0)
+    parser.add_argument('--musixmatch-latency', type=float, default=0.1)
+    parser.add_argument('--musixmatch-error-rate', type=float, default=0.0)
+    parser.add_argument('--database-url')
+    parser.add_argument('--save', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Previous results JSON file.')
+    args = parser.parse_args()
+
+    graph = FakeGraph(latency=args.graph_latency,
+                      error_rate=args.graph_error_rate).start()
+    musixmatch = FakeMusixmatch(latency=args.musixmatch_latency,
+                                error_rate=args.musixmatch_error_rate).start()
+    app, server, counter = start_app(args, graph, musixmatch)
+    url = 'http://127.0.0.1:{0}/'.format(server.server_port)
+
+    results = {}
+    print('{0:<20} {1:>6} {2:>6} {3:>8} {4:>8} {5:>8} {6:>8} {7:>9}'.format(
+        'scenario', 'reqs', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'queries'))
+    for name in args.scenarios.split(','):
+        result = results[name] = run_scenario(
+            name, url, app.config.get('APP_SECRET'), args, counter, graph,
+            musixmatch)
+        print('{0:<20} {requests:>6} {errors:>6} {throughput:>8.1f} '
+              '{p50_ms:>8.1f} {p95_ms:>8.1f} {p99_ms:>8.1f} '
+              '{db_queries_per_request:>9.2f}'.format(name, **result))
+    server.shutdown()
+    graph.stop()
+    musixmatch.stop()
+
+    if args.save:
+        directory = os.path.dirname(args.save)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.save, 'w') as f:
+            json.dump({'config': vars(args), 'scenarios': results}, f,
+                      indent=2, sort_keys=True)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
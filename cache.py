@@ -0,0 +1,205 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class RedisBackend(object):
+    """Shared cache backend so several gunicorn workers reuse results.
+
+    Values are stored JSON encoded under `prefix + key`; `redis` is only
+    imported when a backend is actually configured.
+    """
+
+    def __init__(self, url, prefix='fbc:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return MISSING
+        return json.loads(value.decode('utf-8'))
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl))
+
+    def add(self, key, value, ttl):
+        """Set `key` only when absent, True when it was set."""
+        return bool(self.client.set(
+            self.prefix + key, json.dumps(value), ex=int(ttl), nx=True))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class TTLCache(object):
+    """Thread-safe LRU cache with per-entry expiry and request coalescing.
+
+    `None` and empty values are cached like any other value. Concurrent
+    `get_or_load` misses for the same key share a single loader call.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, backend=None):
+        """
+            @optional:
+                maxsize: max entries kept in process
+                ttl: default time to live in seconds
+                backend: shared second level cache (eg: RedisBackend)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get_local(key)
+        if value is MISSING and self.backend is not None:
+            value = self.backend.get(key)
+            if value is not MISSING:
+                self._set_local(key, value, self.ttl)
+        with self._lock:
+            if value is MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self._set_local(key, value, ttl)
+        if self.backend is not None:
+            self.backend.set(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """Set `key` only when it is not cached yet, atomically per process
+        and, with a backend, across workers. True when it was set.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if self._get_local(key) is not MISSING:
+                self.hits += 1
+                return False
+            if self.backend is None:
+                self._set_unlocked(key, value, ttl)
+                self.misses += 1
+                return True
+        added = self.backend.add(key, value, ttl)
+        self._set_local(key, value, ttl)
+        with self._lock:
+            if added:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return added
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.backend is not None:
+            self.backend.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, loader, ttl=None):
+        """Return the cached value for `key`, calling `loader()` on a miss.
+
+        Only one thread per process runs the loader for a given key; the
+        others wait for its result (or its exception).
+        """
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        with self._lock:
+            value = self._get_local(key)
+            if value is not MISSING:
+                return value
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.wait()
+        try:
+            value = loader()
+        except Exception as error:
+            call.fail(error)
+            raise
+        else:
+            self.set(key, value, ttl)
+            call.done(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'coalesced': self.coalesced,
+            }
+
+    def _get_local(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._data[key]
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _set_local(self, key, value, ttl):
+        with self._lock:
+            self._set_unlocked(key, value, ttl)
+
+    def _set_unlocked(self, key, value, ttl):
+        self._data[key] = (time.time() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+class _Call(object):
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def done(self, value):
+        self._value = value
+        self._event.set()
+
+    def fail(self, error):
+        self._error = error
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
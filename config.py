@@ -9,20 +9,94 @@ class Config(object):
     SECRET_KEY = 'Cohello19'
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         'DATABASE_URL', 'sqlite:///fbc_bot.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Engine pool arguments, SQLAlchemy defaults when empty
+    DB_POOL_OPTIONS = {}
+    PAGE_ACCESS_TOKEN = os.environ.get('PAGE_ACCESS_TOKEN')
+    APP_SECRET = os.environ.get('APP_SECRET')
+    WEBHOOK_MAX_BODY = int(os.environ.get('WEBHOOK_MAX_BODY', 1024 * 1024))
+    GRAPH_API_URL = os.environ.get('GRAPH_API_URL')
+    GRAPH_POOL_MAXSIZE = int(os.environ.get('GRAPH_POOL_MAXSIZE', 16))
+    GRAPH_MAX_RETRIES = int(os.environ.get('GRAPH_MAX_RETRIES', 3))
+    GRAPH_TIMEOUT = float(os.environ.get('GRAPH_TIMEOUT', 10))
+    MUSIXMATCH_API_URL = os.environ.get(
+        'MUSIXMATCH_API_URL', 'http://api.musixmatch.com/ws/1.1')
+    # Comma separated keys spread the quota, MUSIXMATCH_API_KEY when unset
+    MUSIXMATCH_API_KEYS = [key.strip() for key in os.environ.get(
+        'MUSIXMATCH_API_KEYS', os.environ.get(
+            'MUSIXMATCH_API_KEY', '2df63ad0b5eb5f9d024490851cb059a7')).split(
+                ',') if key.strip()]
+    MUSIXMATCH_TIMEOUT = float(os.environ.get('MUSIXMATCH_TIMEOUT', 5))
+    MUSIXMATCH_MAX_RETRIES = int(os.environ.get('MUSIXMATCH_MAX_RETRIES', 1))
+    # Seconds before a duplicate Musixmatch GET is sent, 0 disables it
+    MUSIXMATCH_HEDGE_DELAY = float(
+        os.environ.get('MUSIXMATCH_HEDGE_DELAY', 0))
+    # Requests allowed per Musixmatch key in each quota window
+    MUSIXMATCH_QUOTA = int(os.environ.get('MUSIXMATCH_QUOTA', 2000))
+    MUSIXMATCH_QUOTA_WINDOW = int(
+        os.environ.get('MUSIXMATCH_QUOTA_WINDOW', 24 * 3600))
+    REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 15))
+    # Part of the deadline Musixmatch calls leave for the reply
+    REPLY_RESERVE = float(os.environ.get('REPLY_RESERVE', 3))
+    # Threads running the concurrent I/O of webhook turns
+    TURN_WORKERS = int(os.environ.get('TURN_WORKERS', 16))
+    BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+    BREAKER_RESET = float(os.environ.get('BREAKER_RESET', 30))
+    ATTACHMENT_REGISTRY_PATH = os.environ.get(
+        'ATTACHMENT_REGISTRY_PATH', 'attachments.json')
+    WEBHOOK_ASYNC = os.environ.get('WEBHOOK_ASYNC', '0') == '1'
+    WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+    WEBHOOK_BATCH = os.environ.get('WEBHOOK_BATCH', '0') == '1'
+    # Seen event ids kept to drop Facebook redeliveries
+    DEDUPE_CACHE_SIZE = int(os.environ.get('DEDUPE_CACHE_SIZE', 100000))
+    DEDUPE_TTL = int(os.environ.get('DEDUPE_TTL', 24 * 3600))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1024))
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 3600))
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 3))
+    SEARCH_CURSOR_TTL = int(os.environ.get('SEARCH_CURSOR_TTL', 3600))
+    SEARCH_CURSOR_CACHE_SIZE = int(
+        os.environ.get('SEARCH_CURSOR_CACHE_SIZE', 4096))
+    SEARCH_LOCAL_MIN = int(os.environ.get('SEARCH_LOCAL_MIN', 3))
+    FAVORITES_PAGE_SIZE = int(os.environ.get('FAVORITES_PAGE_SIZE', 50))
+    TRACK_CACHE_SIZE = int(os.environ.get('TRACK_CACHE_SIZE', 4096))
+    TRACK_MAX_AGE = int(os.environ.get('TRACK_MAX_AGE', 7 * 24 * 3600))
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 4096))
+    PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 24 * 3600))
+    COUNTER_FLUSH_INTERVAL = float(os.environ.get('COUNTER_FLUSH_INTERVAL', 5))
+    COUNTER_FLUSH_SIZE = int(os.environ.get('COUNTER_FLUSH_SIZE', 1000))
+    BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 50))
+    BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 8))
+    BROADCAST_CHUNK_SIZE = int(os.environ.get('BROADCAST_CHUNK_SIZE', 500))
+    LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
 
 
 class ProductionConfig(Config):
     DEBUG = False
+    # Pre-ping replaces connections Postgres or a proxy dropped while idle
+    # and recycling keeps them younger than its idle timeout. The pool is
+    # per gunicorn worker; waits give up well within REQUEST_DEADLINE.
+    DB_POOL_OPTIONS = {
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    }
 
 
 class StagingConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
+    DB_POOL_OPTIONS = ProductionConfig.DB_POOL_OPTIONS
 
 
 class DevelopmentConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
+    # One local process against a local database: few idle connections
+    # and no pre-ping round trip per checkout
+    DB_POOL_OPTIONS = {'pool_size': 2, 'max_overflow': 8}
 
 
 class TestingConfig(Config):
@@ -1,8 +1,15 @@
-from project import db
+from project import create_app, db
+from project.schema import upgrade_schema
 # from models import BlogPost
 
-# create the database and the db table
-db.create_all()
+app = create_app()
 
-# commit the changes
-db.session.commit()
+with app.app_context():
+    # create the database and the db table
+    db.create_all()
+    # add the columns and indexes tables created earlier are missing
+    with db.engine.begin() as connection:
+        upgrade_schema(connection)
+
+    # commit the changes
+    db.session.commit()
@@ -1,14 +1,76 @@
 import os
+import fcntl
 import hashlib
 import hmac
+import mmap
 import six
-import attr
 import json
+import threading
+import time
 import requests
 from enum import Enum
+from six.moves.urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from requests_toolbelt import MultipartEncoder
 
 DEFAULT_API_VERSION = 2.6
+DEFAULT_TIMEOUT = (3.05, 10)
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.3
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Methods urllib3 retries after read errors, its default whitelist
+IDEMPOTENT_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS',
+                                'TRACE'])
+# Throttled requests were not processed, so even a POST may be resent
+THROTTLED = 429
+# Longest Retry-After honoured outside of a request deadline
+MAX_RETRY_AFTER = 30
+BATCH_LIMIT = 50
+# Graph error codes for transient failures and throttling
+RETRY_ERROR_CODES = (1, 2, 4, 17, 32, 613)
+# Graph "invalid parameter" error, eg: an invalid or expired attachment id
+INVALID_PARAMETER = 100
+# Send API error subcodes for attachments that cannot be sent
+ATTACHMENT_ERROR_SUBCODES = (2018047,)
+# Send API limits on text messages and button template text
+TEXT_LIMIT = 2000
+BUTTON_TEXT_LIMIT = 640
+# Most elements a generic template may carry
+GENERIC_ELEMENTS_LIMIT = 10
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+def _hub_signature_mac(app_secret, hub_signature_header):
+    """Split an X-Hub-Signature(-256) header into (hmac, hexdigest)."""
+    try:
+        hash_method, hub_signature = hub_signature_header.split('=', 1)
+    except (AttributeError, ValueError):
+        return None, None
+    if hash_method not in ('sha1', 'sha256'):
+        return None, None
+    if not isinstance(app_secret, bytes):
+        app_secret = app_secret.encode('utf8')
+    return (hmac.new(app_secret, digestmod=getattr(hashlib, hash_method)),
+            hub_signature)
+
+
+def _signature_matches(hmac_object, hub_signature):
+    """Constant-time comparison of the computed and the sent hexdigest, as
+    bytes: a header with non-ASCII characters simply does not match.
+    """
+    if not isinstance(hub_signature, bytes):
+        try:
+            hub_signature = str(hub_signature).encode('latin-1')
+        except UnicodeEncodeError:
+            return False
+    return hmac.compare_digest(
+        hmac_object.hexdigest().encode('ascii'), hub_signature)
 
 
 def validate_hub_signature(app_secret, request_payload, hub_signature_header):
@@ -20,18 +82,64 @@ def validate_hub_signature(app_secret, request_payload, hub_signature_header):
         @outputs:
             boolean indicated that hub signature is validated
     """
-    try:
-        hash_method, hub_signature = hub_signature_header.split('=')
-    except:
-        pass
-    else:
-        digest_module = getattr(hashlib, hash_method)
-        hmac_object = hmac.new(
-            str(app_secret), str(request_payload), digest_module)
-        generated_hash = hmac_object.hexdigest()
-        if hub_signature == generated_hash:
-            return True
-    return False
+    hmac_object, hub_signature = _hub_signature_mac(
+        app_secret, hub_signature_header)
+    if hmac_object is None:
+        return False
+    if not isinstance(request_payload, bytes):
+        request_payload = request_payload.encode('utf8')
+    hmac_object.update(request_payload)
+    return _signature_matches(hmac_object, hub_signature)
+
+
+def read_payload(stream, max_length, chunk_size=65536, hmac_object=None):
+    """
+        @inputs:
+            stream: file-like request body
+            max_length: largest body accepted, in bytes
+        @optional:
+            hmac_object: updated with every chunk read
+        @outputs:
+            raw body as bytes; raises PayloadTooLarge as soon as the body
+            exceeds max_length, whatever Content-Length claims.
+    """
+    chunks = []
+    length = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        length += len(chunk)
+        if length > max_length:
+            raise PayloadTooLarge(length)
+        if hmac_object is not None:
+            hmac_object.update(chunk)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def read_signed_payload(app_secret, stream, hub_signature_header,
+                        max_length, chunk_size=65536):
+    """
+        @inputs:
+            app_secret: Secret Key for application
+            stream: file-like request body
+            hub_signature_header: X-Hub-Signature(-256) header
+            max_length: largest body accepted, in bytes
+        @outputs:
+            raw body as bytes when the signature matches, otherwise None.
+            The HMAC is computed while reading and the comparison is
+            constant-time; raises PayloadTooLarge as soon as the body
+            exceeds max_length.
+    """
+    hmac_object, hub_signature = _hub_signature_mac(
+        app_secret, hub_signature_header)
+    if hmac_object is None:
+        return None
+    body = read_payload(stream, max_length, chunk_size, hmac_object)
+    if not _signature_matches(hmac_object, hub_signature):
+        return None
+    return body
 
 
 def generate_appsecret_proof(access_token, app_secret):
@@ -54,14 +162,12 @@ def generate_appsecret_proof(access_token, app_secret):
     return generated_hash
 
 
-class AttrsEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if hasattr(obj, '__attrs_attrs__'):
-            items_iterator = (attr.asdict(obj).items()
-                              if six.PY3 else
-                              attr.asdict(obj).iteritems())
-            return {k: v for k, v in items_iterator if v is not None}
-        return json.JSONEncoder.default(self, obj)
+def auth_params(access_token, app_secret=None):
+    auth = {'access_token': access_token}
+    if app_secret is not None:
+        appsecret_proof = generate_appsecret_proof(access_token, app_secret)
+        auth['appsecret_proof'] = appsecret_proof
+    return auth
 
 
 class NotificationType(Enum):
@@ -70,33 +176,476 @@ class NotificationType(Enum):
     no_push = "NO_PUSH"
 
 
+class AttrsEncoder(json.JSONEncoder):
+    def default(self, obj):
+        # Shallow conversion: the encoder calls back for nested attrs
+        # instances, so there is no need for a recursive attr.asdict copy.
+        fields = getattr(obj, '__attrs_attrs__', None)
+        if fields is not None:
+            result = {}
+            for field in fields:
+                value = getattr(obj, field.name)
+                if value is not None:
+                    result[field.name] = value
+            return result
+        return json.JSONEncoder.default(self, obj)
+
+
+def dumps(payload):
+    """Compact JSON bytes for a Send API payload."""
+    return json.dumps(payload, cls=AttrsEncoder,
+                      separators=(',', ':')).encode('utf8')
+
+
+def recipient_payload(recipient_id, payload,
+                      notification_type=NotificationType.regular):
+    payload['recipient'] = {'id': recipient_id}
+    payload['notification_type'] = notification_type.value
+    return payload
+
+
+def text_message(text):
+    return {'text': text}
+
+
+def pack_lines(lines, limit=TEXT_LIMIT):
+    """Join lines into as few texts of at most `limit` characters as
+    possible, without splitting a line unless it is longer than `limit`.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        while len(line) > limit:
+            head, line = line[:limit], line[limit:]
+            if chunk:
+                yield '\n'.join(chunk)
+                chunk, size = [], 0
+            yield head
+        added = len(line) + (1 if chunk else 0)
+        if chunk and size + added > limit:
+            yield '\n'.join(chunk)
+            chunk, size, added = [], 0, len(line)
+        chunk.append(line)
+        size += added
+    if chunk:
+        yield '\n'.join(chunk)
+
+
+def quick_reply_message(text, buttons):
+    return {
+        'text': text,
+        'quick_replies': buttons
+    }
+
+
+def attachment_message(attachment_type, payload):
+    return {
+        'attachment': {
+            'type': attachment_type,
+            'payload': payload
+        }
+    }
+
+
+def attachment_url_message(attachment_type, attachment_url):
+    return attachment_message(attachment_type, {'url': attachment_url})
+
+
+def attachment_id_message(attachment_type, attachment_id):
+    return attachment_message(attachment_type,
+                              {'attachment_id': attachment_id})
+
+
+def button_template(text, buttons):
+    return {
+        "attachment": {
+            "type": "template",
+            "payload": {
+                "template_type": "button",
+                "text": text,
+                "buttons": buttons
+            }
+        }
+    }
+
+
+def attachment_content_type(attachment_type, attachment_path):
+    """Multipart filename and content type, eg: ('a.mp3', 'audio/mp3')."""
+    attachment_filename = os.path.basename(attachment_path)
+    if attachment_type != 'file':
+        attachment_ext = attachment_filename.split('.')[1]
+        content_type = attachment_type + '/' + attachment_ext  # eg: audio/mp3
+    else:
+        content_type = ''
+    return attachment_filename, content_type
+
+
+def user_info_params(fields=None):
+    params = {}
+    if fields is not None and isinstance(fields, (list, tuple)):
+        params['fields'] = ",".join(fields)
+    return params
+
+
+def generic_template(elements, image_aspect_ratio='horizontal'):
+    return {
+        "attachment": {
+            "type": "template",
+            "payload": {
+                "template_type": "generic",
+                "image_aspect_ratio": image_aspect_ratio,
+                "elements": elements
+            }
+        }
+    }
+
+
+class MessageTemplate(object):
+    """Constant Send API message serialized once.
+
+    Rendering only splices the recipient id in front of the pre-encoded
+    bytes, eg:
+        reports = MessageTemplate(generic_template(elements))
+        bot.send_template(recipient_id, reports)
+    """
+
+    def __init__(self, message, notification_type=NotificationType.regular):
+        self.message = message
+        self.notification_type = notification_type
+        body = dumps({'message': message,
+                      'notification_type': notification_type.value})
+        self._suffix = b'},' + body[1:]
+
+    def payload(self, recipient_id):
+        return {'recipient': {'id': recipient_id},
+                'message': self.message,
+                'notification_type': self.notification_type.value}
+
+    def render(self, recipient_id):
+        return (b'{"recipient":{"id":' +
+                json.dumps(str(recipient_id)).encode('utf8') + self._suffix)
+
+
+def attachment_error(result):
+    """Whether a Send API response is an error about the attachment
+    itself (invalid or expired attachment id), not about the recipient or
+    a transient failure.
+    """
+    error = result.get('error') if isinstance(result, dict) else None
+    if not isinstance(error, dict):
+        return False
+    if error.get('error_subcode') in ATTACHMENT_ERROR_SUBCODES:
+        return True
+    return (error.get('code') == INVALID_PARAMETER and
+            'attachment' in (error.get('message') or '').lower())
+
+
+def file_digest(path):
+    """SHA-256 of a file, read through a memory map."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256(b'').hexdigest()
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return hashlib.sha256(mapped).hexdigest()
+        finally:
+            mapped.close()
+
+
+class AttachmentRegistry(object):
+    """Reusable attachment ids keyed by attachment type and content hash,
+    persisted as JSON so uploads survive restarts. Processes sharing the
+    file merge their changes into it under a file lock.
+    """
+
+    def __init__(self, path=None):
+        """
+            @optional:
+                path: JSON file to load from and save to, in memory only
+                    when omitted
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids = self._load()
+
+    def key(self, attachment_type, attachment_path):
+        return '{0}:{1}'.format(attachment_type, file_digest(attachment_path))
+
+    def get(self, key):
+        with self._lock:
+            return self._ids.get(key)
+
+    def set(self, key, attachment_id):
+        with self._lock:
+            self._ids[key] = attachment_id
+            self._save(key, attachment_id)
+
+    def discard(self, key):
+        with self._lock:
+            attachment_id = self._ids.pop(key, None)
+            if attachment_id is not None:
+                self._save(key, None, discarded=attachment_id)
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _save(self, key, attachment_id, discarded=None):
+        """Merge one change into the file: it is re-read under an exclusive
+        lock, so ids saved by other processes are kept, then replaced
+        atomically. A discard only drops `key` while it still holds the
+        `discarded` id.
+        """
+        if self.path is None:
+            return
+        with open('{0}.lock'.format(self.path), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            ids = self._load()
+            if attachment_id is not None:
+                ids[key] = attachment_id
+            elif ids.get(key) == discarded:
+                del ids[key]
+            tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(ids, f)
+            os.rename(tmp_path, self.path)
+        self._ids = ids
+
+
+class SendRetry(Retry):
+    """Retry policy that never resends a request the Graph API may have
+    processed: read errors and 5xx are only retried for idempotent methods
+    (eg: GET), a POST only after connection errors and 429. Retry-After
+    waits are capped by the time `deadline()` has left.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.deadline = kwargs.pop('deadline', None)
+        super(SendRetry, self).__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        kwargs.setdefault('deadline', self.deadline)
+        return super(SendRetry, self).new(**kwargs)
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if (status_code == THROTTLED and self.status_forcelist and
+                THROTTLED in self.status_forcelist):
+            return True
+        return super(SendRetry, self).is_retry(
+            method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        retry_after = super(SendRetry, self).get_retry_after(response)
+        if retry_after is None:
+            return None
+        left = MAX_RETRY_AFTER
+        if self.deadline is not None:
+            try:
+                left = self.deadline()
+            except requests.RequestException:
+                # Deadline already exceeded
+                left = 0
+            if left is None:
+                left = MAX_RETRY_AFTER
+        return max(0, min(retry_after, left))
+
+
+class Transport(object):
+    """Pooled keep-alive HTTP transport shared by every Graph API call.
+
+    A single `HTTPAdapter` (and therefore a single bounded urllib3 pool per
+    host) is mounted on one `requests.Session` per thread, so gunicorn
+    threads reuse the same TCP/TLS connections without sharing session
+    state.
+    """
+
+    def __init__(self,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 timeout=DEFAULT_TIMEOUT,
+                 pool_block=False,
+                 observer=None,
+                 breaker=None,
+                 deadline=None):
+        """
+            @optional:
+                pool_connections: number of hosts to keep pools for
+                pool_maxsize: max keep-alive connections per host
+                max_retries: retries on connection errors and 429, plus
+                    read errors and 5xx for idempotent methods, see
+                    `SendRetry`
+                backoff_factor: exponential backoff between retries
+                timeout: default (connect, read) timeout in seconds
+                pool_block: wait for a free connection instead of
+                    opening a throwaway one when the pool is exhausted
+                observer: called as observer(method, url, status, seconds)
+                    after every request, status is None on errors
+                breaker: circuit breaker with before/success/failure,
+                    tripped by connection errors and 5xx responses
+                deadline: callable returning the seconds left for the
+                    current request (or None), see `attempt_timeout`
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.observer = observer
+        self.breaker = breaker
+        self.deadline = deadline
+        retry = SendRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            raise_on_status=False,
+            respect_retry_after_header=True,
+            deadline=deadline)
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+            pool_block=pool_block)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.deadline is not None:
+            kwargs['timeout'] = self.attempt_timeout(
+                self.deadline(), kwargs['timeout'], method)
+        if self.breaker is not None:
+            self.breaker.before()
+        with self._lock:
+            self._requests += 1
+        status = None
+        started = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        except requests.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            if self.breaker is not None:
+                if status is None or status >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+            if self.observer is not None:
+                self.observer(method, url, status, time.time() - started)
+
+    def attempt_timeout(self, left, timeout=None, method='GET'):
+        """(connect, read) timeout for each try so that all of them
+        together fit in `left` seconds; `timeout` (or the default) when
+        left is None. Only idempotent methods are retried after a read
+        timeout, others (eg: POST) may read for all of `left`.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if left is None:
+            return timeout
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+        else:
+            connect = read = timeout
+        share = float(left) / (self.max_retries + 1)
+        read_left = (share if method.upper() in IDEMPOTENT_METHODS
+                     else float(left))
+        return (share if connect is None else min(connect, share),
+                read_left if read is None else min(read, read_left))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Snapshot of request counters and per-host pool usage."""
+        pools = []
+        pool_manager = self.adapter.poolmanager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'scheme': pool.scheme,
+                'host': pool.host,
+                'port': pool.port,
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': sum(1 for conn in list(pool.pool.queue)
+                            if conn is not None) if pool.pool else 0,
+            })
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'errors': self._errors,
+                'pools': pools,
+            }
+
+    def close(self):
+        self.adapter.close()
+
+
 class Bot(object):
     def __init__(self,
                  access_token,
                  api_version=DEFAULT_API_VERSION,
-                 app_secret=None):
+                 app_secret=None,
+                 transport=None,
+                 profile_cache=None,
+                 profile_fallback=None,
+                 graph_url=None,
+                 attachment_registry=None):
         """
             @required:
                 access_token
             @optional:
                 api_version
                 app_secret
+                transport: shared `Transport`, one is created if omitted
+                profile_cache: TTLCache for `get_user_info` results
+                profile_fallback: callable(recipient_id) returning a
+                    stored profile <dict> (or None) tried before the
+                    Graph API on a cache miss
+                graph_url: Graph API root, eg: a local stand-in server
+                attachment_registry: AttachmentRegistry reusing uploaded
+                    attachment ids for `send_attachment`
         """
+        self.transport = transport if transport is not None else Transport()
+        self.profile_cache = profile_cache
+        self.profile_fallback = profile_fallback
+        self.attachment_registry = attachment_registry
         self.api_version = api_version
         self.app_secret = app_secret
-        self.graph_url = 'https://graph.facebook.com/v{0}'.format(
-            self.api_version)
+        if graph_url is None:
+            graph_url = 'https://graph.facebook.com/v{0}'.format(
+                self.api_version)
+        self.graph_url = graph_url
         self.access_token = access_token
 
     @property
     def auth_args(self):
         if not hasattr(self, '_auth_args'):
-            auth = {'access_token': self.access_token}
-            if self.app_secret is not None:
-                appsecret_proof = generate_appsecret_proof(
-                    self.access_token, self.app_secret)
-                auth['appsecret_proof'] = appsecret_proof
-            self._auth_args = auth
+            self._auth_args = auth_params(self.access_token, self.app_secret)
         return self._auth_args
 
     def add_domains_to_whitelist(self, domains):
@@ -105,7 +654,7 @@ class Bot(object):
         }
 
         request_endpoint = '{0}/me/messenger_profile'.format(self.graph_url)
-        response = requests.post(
+        response = self.transport.post(
             request_endpoint,
             params=self.auth_args,
             json=payload
@@ -117,9 +666,8 @@ class Bot(object):
                        recipient_id,
                        payload,
                        notification_type=NotificationType.regular):
-        payload['recipient'] = {'id': recipient_id}
-        payload['notification_type'] = notification_type.value
-        return self.send_raw(payload)
+        return self.send_raw(
+            recipient_payload(recipient_id, payload, notification_type))
 
     def send_message(self,
                      recipient_id,
@@ -134,6 +682,8 @@ class Bot(object):
                         attachment_path,
                         notification_type=NotificationType.regular):
         """Send an attachment to the specified recipient using local path.
+        With an `attachment_registry` the file is uploaded once as a
+        reusable attachment and later sends only reference its id.
         Input:
             recipient_id: recipient id to send to
             attachment_type: type of attachment (image, video, audio, file)
@@ -141,31 +691,65 @@ class Bot(object):
         Output:
             Response from API as <dict>
         """
-        with open(attachment_path, 'rb') as f:
-            attachment_filename = os.path.basename(attachment_path)
-            if attachment_type != 'file':
-                attachment_ext = attachment_filename.split('.')[1]
-                content_type = attachment_type + '/' + attachment_ext  # eg: audio/mp3
-            else:
-                content_type = ''
-            payload = {
+        if self.attachment_registry is not None:
+            return self._send_registered_attachment(
+                recipient_id, attachment_type, attachment_path,
+                notification_type)
+        return self._post_attachment(
+            'me/messages', attachment_type, attachment_path, {
                 'recipient': json.dumps({
                     'id': recipient_id
                 }),
                 'notification_type': notification_type.value,
-                'message': json.dumps({
-                    'attachment': {
-                        'type': attachment_type,
-                        'payload': {}
-                    }
-                }),
-                'filedata':
-                (attachment_filename, f, content_type)
-            }
+            }, {})
+
+    def upload_attachment(self, attachment_type, attachment_path):
+        """Upload a file as a reusable attachment.
+        https://developers.facebook.com/docs/messenger-platform/send-messages/saving-assets
+        Input:
+            attachment_type: type of attachment (image, video, audio, file)
+            attachment_path: Path of attachment
+        Output:
+            attachment_id, or None if the upload failed
+        """
+        result = self._post_attachment(
+            'me/message_attachments', attachment_type, attachment_path, {},
+            {'is_reusable': True})
+        return result.get('attachment_id')
+
+    def _send_registered_attachment(self, recipient_id, attachment_type,
+                                    attachment_path, notification_type):
+        registry = self.attachment_registry
+        key = registry.key(attachment_type, attachment_path)
+        attachment_id = registry.get(key)
+        if attachment_id is None:
+            attachment_id = self.upload_attachment(
+                attachment_type, attachment_path)
+            if attachment_id is None:
+                return {'error': {'message': 'Attachment upload failed'}}
+            registry.set(key, attachment_id)
+        result = self.send_message(
+            recipient_id,
+            attachment_id_message(attachment_type, attachment_id),
+            notification_type)
+        if attachment_error(result):
+            # Let the next send upload the file again
+            registry.discard(key)
+        return result
+
+    def _post_attachment(self, endpoint, attachment_type, attachment_path,
+                         fields, attachment_payload):
+        with open(attachment_path, 'rb') as f:
+            attachment_filename, content_type = attachment_content_type(
+                attachment_type, attachment_path)
+            payload = dict(fields)
+            payload['message'] = json.dumps(
+                attachment_message(attachment_type, attachment_payload))
+            payload['filedata'] = (attachment_filename, f, content_type)
             multipart_data = MultipartEncoder(payload)
             multipart_header = {'Content-Type': multipart_data.content_type}
-            request_endpoint = '{0}/me/messages'.format(self.graph_url)
-            return requests.post(
+            request_endpoint = '{0}/{1}'.format(self.graph_url, endpoint)
+            return self.transport.post(
                 request_endpoint,
                 data=multipart_data,
                 params=self.auth_args,
@@ -184,14 +768,10 @@ class Bot(object):
         Output:
             Response from API as <dict>
         """
-        return self.send_message(recipient_id, {
-            'attachment': {
-                'type': attachment_type,
-                'payload': {
-                    'url': attachment_url
-                }
-            }
-        }, notification_type)
+        return self.send_message(
+            recipient_id,
+            attachment_url_message(attachment_type, attachment_url),
+            notification_type)
 
     def send_text_message(self,
                           recipient_id,
@@ -205,7 +785,7 @@ class Bot(object):
         Output:
             Response from API as <dict>
         """
-        return self.send_message(recipient_id, {'text': message},
+        return self.send_message(recipient_id, text_message(message),
                                  notification_type)
 
     def send_generic_message(self,
@@ -222,16 +802,9 @@ class Bot(object):
         Output:
             Response from API as <dict>
         """
-        return self.send_message(recipient_id, {
-            "attachment": {
-                "type": "template",
-                "payload": {
-                    "template_type": "generic",
-                    "image_aspect_ratio": image_aspect_ratio,
-                    "elements": elements
-                }
-            }
-        }, notification_type)
+        return self.send_message(
+            recipient_id, generic_template(elements, image_aspect_ratio),
+            notification_type)
 
     def send_quick_reply(self,
                          recipient_id,
@@ -247,10 +820,9 @@ class Bot(object):
         Output:
             Response from API as <dict>
         """
-        return self.send_message(recipient_id, {
-            'text': message,
-            'quick_replies': buttons
-        }, notification_type)
+        return self.send_message(
+            recipient_id, quick_reply_message(message, buttons),
+            notification_type)
 
     def send_button_message(self,
                             recipient_id,
@@ -266,16 +838,8 @@ class Bot(object):
         Output:
             Response from API as <dict>
         """
-        return self.send_message(recipient_id, {
-            "attachment": {
-                "type": "template",
-                "payload": {
-                    "template_type": "button",
-                    "text": text,
-                    "buttons": buttons
-                }
-            }
-        }, notification_type)
+        return self.send_message(
+            recipient_id, button_template(text, buttons), notification_type)
 
     def send_action(self,
                     recipient_id,
@@ -418,37 +982,183 @@ class Bot(object):
         return self.send_attachment_url(recipient_id, "file", file_url,
                                         notification_type)
 
-    def get_user_info(self, recipient_id, fields=None):
+    def get_user_info(self, recipient_id, fields=None, refresh=False):
         """Getting information about the user
         https://developers.facebook.com/docs/messenger-platform/user-profile
+        Default field lookups are served from `profile_cache` and then
+        `profile_fallback` when configured; the Graph API is only called
+        for unknown users or when `refresh` is set.
         Input:
           recipient_id: recipient id to send to
+          refresh: bypass the cache and fetch from the Graph API
         Output:
           Response from API as <dict>
         """
-        params = {}
-        if fields is not None and isinstance(fields, (list, tuple)):
-            params['fields'] = ",".join(fields)
+        if self.profile_cache is None or fields is not None:
+            return self._fetch_user_info(recipient_id, fields)
+
+        cache_key = 'profile:{0}'.format(recipient_id)
+        if not refresh:
+            user_info = self.profile_cache.get(cache_key)
+            if user_info is not None:
+                return user_info
+            if self.profile_fallback is not None:
+                user_info = self.profile_fallback(recipient_id)
+                if user_info is not None:
+                    self.profile_cache.set(cache_key, user_info)
+                    return user_info
 
+        user_info = self._fetch_user_info(recipient_id)
+        if user_info is not None:
+            self.profile_cache.set(cache_key, user_info)
+        return user_info
+
+    def _fetch_user_info(self, recipient_id, fields=None):
+        params = user_info_params(fields)
         params.update(self.auth_args)
 
         request_endpoint = '{0}/{1}'.format(self.graph_url, recipient_id)
-        response = requests.get(request_endpoint, params=params)
+        response = self.transport.get(request_endpoint, params=params)
         if response.status_code == 200:
             return response.json()
 
         return None
 
+    def send_template(self, recipient_id, template):
+        """Send a pre-serialized `MessageTemplate` to the recipient.
+        Output:
+            Response from API as <dict>
+        """
+        return self.send_serialized(template.render(recipient_id))
+
     def send_raw(self, payload):
+        return self.send_serialized(dumps(payload))
+
+    def send_serialized(self, data):
         request_endpoint = '{0}/me/messages'.format(self.graph_url)
-        response = requests.post(
+        response = self.transport.post(
             request_endpoint,
             params=self.auth_args,
-            data=json.dumps(payload, cls=AttrsEncoder),
+            data=data,
             headers={'Content-Type': 'application/json'})
         result = response.json()
         return result
 
+    def batch(self):
+        """Collect sends and deliver them with Graph batch requests.
+        Every send_* method of the returned `Batch` queues its payload and
+        returns its index in the results list, eg:
+            with bot.batch() as batch:
+                batch.send_text_message(recipient_id, 'hola')
+            batch.results
+        """
+        return Batch(self)
+
+    def send_batch(self, payloads, max_attempts=3, backoff=0.5):
+        """Send Send API payloads in Graph batch requests of up to
+        BATCH_LIMIT items. Items that fail with a transient error are
+        retried on their own, up to `max_attempts` times.
+        https://developers.facebook.com/docs/graph-api/making-multiple-requests
+        Input:
+            payloads: list of send_raw payloads
+        Output:
+            list with one response <dict> per payload, in order
+        """
+        results = [None] * len(payloads)
+        pending = list(range(len(payloads)))
+        for attempt in range(max_attempts):
+            failed = []
+            for start in range(0, len(pending), BATCH_LIMIT):
+                chunk = pending[start:start + BATCH_LIMIT]
+                responses = self._post_batch(
+                    [payloads[index] for index in chunk])
+                for index, (result, retry) in zip(chunk, responses):
+                    results[index] = result
+                    if retry:
+                        failed.append(index)
+            pending = failed
+            if not pending or attempt == max_attempts - 1:
+                break
+            time.sleep(backoff * 2 ** attempt)
+        return results
+
+    def _post_batch(self, payloads):
+        """One Graph batch request; returns (result, retry) per payload."""
+        batch = []
+        for payload in payloads:
+            body = dict(
+                (key, value if isinstance(value, six.string_types)
+                 else json.dumps(value, cls=AttrsEncoder))
+                for key, value in payload.items())
+            batch.append({
+                'method': 'POST',
+                'relative_url': 'me/messages',
+                'body': urlencode(body),
+            })
+        try:
+            response = self.transport.post(
+                self.graph_url + '/',
+                params=self.auth_args,
+                data={'batch': json.dumps(batch), 'include_headers': 'false'})
+            items = response.json() if response.status_code == 200 else None
+        except (requests.RequestException, ValueError) as error:
+            items, response = None, error
+        if not isinstance(items, list) or len(items) != len(payloads):
+            error = {'error': {'message': 'Batch request failed: {0}'.format(
+                getattr(response, 'status_code', response))}}
+            return [(error, True)] * len(payloads)
+
+        results = []
+        for item in items:
+            if item is None:
+                results.append(
+                    ({'error': {'message': 'No response for item'}}, True))
+                continue
+            try:
+                result = json.loads(item.get('body') or '{}')
+            except ValueError:
+                result = {'error': {'message': item.get('body')}}
+            code = item.get('code', 500)
+            error_code = (result.get('error') or {}).get('code')
+            retry = (code == 429 or code >= 500 or
+                     error_code in RETRY_ERROR_CODES)
+            results.append((result, retry))
+        return results
+
     def _send_payload(self, payload):
         """ Deprecated, use send_raw instead """
         return self.send_raw(payload)
+
+
+class Batch(Bot):
+    """Bot whose Send API calls are queued and delivered by `execute`.
+    Attachment uploads are multipart and are still sent immediately.
+    """
+
+    def __init__(self, bot):
+        super(Batch, self).__init__(
+            bot.access_token, bot.api_version, bot.app_secret,
+            transport=bot.transport, graph_url=bot.graph_url,
+            attachment_registry=bot.attachment_registry)
+        self.bot = bot
+        self.payloads = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def send_raw(self, payload):
+        self.payloads.append(payload)
+        return len(self.payloads) - 1
+
+    def send_template(self, recipient_id, template):
+        return self.send_raw(template.payload(recipient_id))
+
+    def execute(self, **kwargs):
+        self.results = self.bot.send_batch(self.payloads, **kwargs)
+        self.payloads = []
+        return self.results
@@ -0,0 +1,236 @@
+import asyncio
+import json
+
+import aiohttp
+
+from fb import (
+    DEFAULT_API_VERSION, NotificationType, attachment_content_type,
+    attachment_message, attachment_url_message, auth_params, button_template,
+    dumps, generic_template, quick_reply_message, recipient_payload,
+    text_message, user_info_params)
+
+DEFAULT_POOL_SIZE = 100
+DEFAULT_CONCURRENCY = 100
+DEFAULT_TIMEOUT = 10
+
+
+class AsyncBot(object):
+    """asyncio counterpart of `fb.Bot`.
+
+    Payloads are built by the same helpers as `fb.Bot`. All calls share one
+    aiohttp connection pool and at most `max_concurrency` Graph API
+    requests are in flight at a time. Use it as an async context manager
+    (or call `close()`) so the pool is released, eg:
+        async with AsyncBot(token) as bot:
+            await bot.send_text_message(recipient_id, 'hola')
+    """
+
+    def __init__(self,
+                 access_token,
+                 api_version=DEFAULT_API_VERSION,
+                 app_secret=None,
+                 graph_url=None,
+                 pool_size=DEFAULT_POOL_SIZE,
+                 max_concurrency=DEFAULT_CONCURRENCY,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+            @required:
+                access_token
+            @optional:
+                api_version
+                app_secret
+                graph_url: Graph API root, eg: a local stand-in server
+                pool_size: max open connections in the shared pool
+                max_concurrency: max Graph API requests in flight
+                timeout: total seconds allowed per request
+        """
+        self.api_version = api_version
+        self.app_secret = app_secret
+        self.access_token = access_token
+        if graph_url is None:
+            graph_url = 'https://graph.facebook.com/v{0}'.format(
+                self.api_version)
+        self.graph_url = graph_url
+        self.auth_args = auth_params(access_token, app_secret)
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def session(self):
+        # Created lazily so the pool and semaphore bind to the running loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, endpoint, **kwargs):
+        session = self.session
+        params = dict(self.auth_args)
+        params.update(kwargs.pop('params', {}))
+        async with self._semaphore:
+            async with session.request(
+                    method, '{0}/{1}'.format(self.graph_url, endpoint),
+                    params=params, **kwargs) as response:
+                result = await response.json(content_type=None)
+                return response.status, result
+
+    async def send_raw(self, payload):
+        status, result = await self._request(
+            'POST', 'me/messages', data=dumps(payload),
+            headers={'Content-Type': 'application/json'})
+        return result
+
+    async def send_recipient(self,
+                             recipient_id,
+                             payload,
+                             notification_type=NotificationType.regular):
+        return await self.send_raw(
+            recipient_payload(recipient_id, payload, notification_type))
+
+    async def send_message(self,
+                           recipient_id,
+                           message,
+                           notification_type=NotificationType.regular):
+        return await self.send_recipient(recipient_id, {'message': message},
+                                         notification_type)
+
+    async def send_template(self, recipient_id, template):
+        """Send a pre-serialized `fb.MessageTemplate`."""
+        status, result = await self._request(
+            'POST', 'me/messages', data=template.render(recipient_id),
+            headers={'Content-Type': 'application/json'})
+        return result
+
+    async def send_text_message(self,
+                                recipient_id,
+                                message,
+                                notification_type=NotificationType.regular):
+        return await self.send_message(
+            recipient_id, text_message(message), notification_type)
+
+    async def send_generic_message(self,
+                                   recipient_id,
+                                   elements,
+                                   image_aspect_ratio='horizontal',
+                                   notification_type=NotificationType.regular):
+        return await self.send_message(
+            recipient_id, generic_template(elements, image_aspect_ratio),
+            notification_type)
+
+    async def send_quick_reply(self,
+                               recipient_id,
+                               message,
+                               buttons,
+                               notification_type=NotificationType.regular):
+        return await self.send_message(
+            recipient_id, quick_reply_message(message, buttons),
+            notification_type)
+
+    async def send_button_message(self,
+                                  recipient_id,
+                                  text,
+                                  buttons,
+                                  notification_type=NotificationType.regular):
+        return await self.send_message(
+            recipient_id, button_template(text, buttons), notification_type)
+
+    async def send_action(self,
+                          recipient_id,
+                          action,
+                          notification_type=NotificationType.regular):
+        return await self.send_recipient(
+            recipient_id, {'sender_action': action}, notification_type)
+
+    async def send_attachment_url(self,
+                                  recipient_id,
+                                  attachment_type,
+                                  attachment_url,
+                                  notification_type=NotificationType.regular):
+        return await self.send_message(
+            recipient_id,
+            attachment_url_message(attachment_type, attachment_url),
+            notification_type)
+
+    async def send_attachment(self,
+                              recipient_id,
+                              attachment_type,
+                              attachment_path,
+                              notification_type=NotificationType.regular):
+        """Multipart upload of a local file, like `fb.Bot.send_attachment`.
+        """
+        attachment_filename, content_type = attachment_content_type(
+            attachment_type, attachment_path)
+        with open(attachment_path, 'rb') as f:
+            form = aiohttp.FormData()
+            form.add_field('recipient', json.dumps({'id': recipient_id}))
+            form.add_field('notification_type', notification_type.value)
+            form.add_field('message', json.dumps(
+                attachment_message(attachment_type, {})))
+            form.add_field('filedata', f, filename=attachment_filename,
+                           content_type=content_type or None)
+            status, result = await self._request(
+                'POST', 'me/messages', data=form)
+        return result
+
+    async def send_image(self, recipient_id, image_path,
+                         notification_type=NotificationType.regular):
+        return await self.send_attachment(recipient_id, "image", image_path,
+                                          notification_type)
+
+    async def send_image_url(self, recipient_id, image_url,
+                             notification_type=NotificationType.regular):
+        return await self.send_attachment_url(recipient_id, "image",
+                                              image_url, notification_type)
+
+    async def send_audio(self, recipient_id, audio_path,
+                         notification_type=NotificationType.regular):
+        return await self.send_attachment(recipient_id, "audio", audio_path,
+                                          notification_type)
+
+    async def send_audio_url(self, recipient_id, audio_url,
+                             notification_type=NotificationType.regular):
+        return await self.send_attachment_url(recipient_id, "audio",
+                                              audio_url, notification_type)
+
+    async def send_video(self, recipient_id, video_path,
+                         notification_type=NotificationType.regular):
+        return await self.send_attachment(recipient_id, "video", video_path,
+                                          notification_type)
+
+    async def send_video_url(self, recipient_id, video_url,
+                             notification_type=NotificationType.regular):
+        return await self.send_attachment_url(recipient_id, "video",
+                                              video_url, notification_type)
+
+    async def send_file(self, recipient_id, file_path,
+                        notification_type=NotificationType.regular):
+        return await self.send_attachment(recipient_id, "file", file_path,
+                                          notification_type)
+
+    async def send_file_url(self, recipient_id, file_url,
+                            notification_type=NotificationType.regular):
+        return await self.send_attachment_url(recipient_id, "file", file_url,
+                                              notification_type)
+
+    async def get_user_info(self, recipient_id, fields=None):
+        status, result = await self._request(
+            'GET', str(recipient_id), params=user_info_params(fields))
+        if status == 200:
+            return result
+        return None
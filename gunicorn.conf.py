@@ -0,0 +1,4 @@
+def post_worker_init(worker):
+    """Start the webhook queue workers in each serving process."""
+    from project import start_workers
+    start_workers(worker.wsgi)
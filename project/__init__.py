@@ -1,18 +1,188 @@
 import os
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from config import Config
-from fb import Bot
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, current_app
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from werkzeug.local import LocalProxy
+from cache import RedisBackend, TTLCache
+from fb import AttachmentRegistry, Bot, Transport
+from project import metrics
+from project.logs import setup_logging
+from resilience import CircuitBreaker, remaining
 
+# Pool arguments only QueuePool takes, SQLite uses NullPool or StaticPool
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
 
-app = Flask(__name__)
-app.config.from_object(Config)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-bot = Bot(os.environ["PAGE_ACCESS_TOKEN"])
 
-from project.views import project_blueprint
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy creating its engine with the app's
+    `DB_POOL_OPTIONS` (pre-ping, recycle and pool sizes).
+    """
 
-app.register_blueprint(project_blueprint)
+    def apply_driver_hacks(self, app, info, options):
+        result = super(SQLAlchemy, self).apply_driver_hacks(
+            app, info, options)
+        pool_options = dict(app.config['DB_POOL_OPTIONS'])
+        if info.drivername.startswith('sqlite'):
+            for name in QUEUE_POOL_OPTIONS:
+                pool_options.pop(name, None)
+        options.update(pool_options)
+        return result
+
+
+db = SQLAlchemy()
+metrics.instrument_session(db.session)
+
+
+def _service(name):
+    """Proxy to the current app's `name` service, see `create_app`."""
+    return LocalProxy(lambda: current_app.extensions['fbc'][name])
+
+
+graph_breaker = _service('graph_breaker')
+transport = _service('transport')
+bot = _service('bot')
+turn_executor = _service('turn_executor')
+search_cache = _service('search_cache')
+search_cursors = _service('search_cursors')
+seen_events = _service('seen_events')
+event_queue = _service('event_queue')
+track_store = _service('track_store')
+counters = _service('counters')
+
+
+def create_app(config=None):
+    """Build the app and its services for `config`, an object or import
+    path (default: APP_SETTINGS or config.ProductionConfig). Importing
+    `project` creates none of them; queue workers are started separately
+    by `start_workers`.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config or os.environ.get(
+        'APP_SETTINGS', 'config.ProductionConfig'))
+    setup_logging(app, app.config['LOG_SAMPLE_RATE'])
+    db.init_app(app)
+    with app.app_context():
+        metrics.instrument_engine(db.engine)
+    services = app.extensions['fbc'] = {}
+    services['graph_breaker'] = CircuitBreaker(
+        'graph', app.config['BREAKER_FAILURES'], app.config['BREAKER_RESET'])
+    services['transport'] = Transport(
+        pool_maxsize=app.config['GRAPH_POOL_MAXSIZE'],
+        max_retries=app.config['GRAPH_MAX_RETRIES'],
+        timeout=(3.05, app.config['GRAPH_TIMEOUT']),
+        observer=metrics.observe_graph,
+        breaker=services['graph_breaker'],
+        deadline=remaining)
+    cache_backend = (RedisBackend(app.config['CACHE_REDIS_URL'])
+                     if app.config['CACHE_REDIS_URL'] else None)
+    services['bot'] = Bot(
+        app.config['PAGE_ACCESS_TOKEN'], transport=services['transport'],
+        graph_url=app.config['GRAPH_API_URL'],
+        profile_cache=TTLCache(maxsize=app.config['PROFILE_CACHE_SIZE'],
+                               ttl=app.config['PROFILE_CACHE_TTL'],
+                               backend=cache_backend),
+        attachment_registry=AttachmentRegistry(
+            app.config['ATTACHMENT_REGISTRY_PATH']))
+    from project.musixmatch import Musixmatch, QuotaBudget, observe
+
+    services['musixmatch'] = Musixmatch(
+        app.config['MUSIXMATCH_API_URL'],
+        Transport(max_retries=app.config['MUSIXMATCH_MAX_RETRIES'],
+                  timeout=(3.05, app.config['MUSIXMATCH_TIMEOUT']),
+                  observer=observe,
+                  breaker=CircuitBreaker('musixmatch',
+                                         app.config['BREAKER_FAILURES'],
+                                         app.config['BREAKER_RESET'])),
+        QuotaBudget(app.config['MUSIXMATCH_API_KEYS'],
+                    app.config['MUSIXMATCH_QUOTA'],
+                    app.config['MUSIXMATCH_QUOTA_WINDOW'],
+                    backend=cache_backend),
+        hedge_delay=app.config['MUSIXMATCH_HEDGE_DELAY'],
+        reply_reserve=app.config['REPLY_RESERVE'],
+        executor=ThreadPoolExecutor(max_workers=8))
+    services['turn_executor'] = ThreadPoolExecutor(
+        max_workers=app.config['TURN_WORKERS'])
+    services['search_cache'] = TTLCache(
+        maxsize=app.config['SEARCH_CACHE_SIZE'],
+        ttl=app.config['SEARCH_CACHE_TTL'], backend=cache_backend)
+    services['search_cursors'] = TTLCache(
+        maxsize=app.config['SEARCH_CURSOR_CACHE_SIZE'],
+        ttl=app.config['SEARCH_CURSOR_TTL'], backend=cache_backend)
+    services['seen_events'] = TTLCache(
+        maxsize=app.config['DEDUPE_CACHE_SIZE'],
+        ttl=app.config['DEDUPE_TTL'], backend=cache_backend)
+
+    from project.outbox import EventQueue
+    from project.tracks import TrackStore
+    from project.counters import CounterBuffer
+
+    services['event_queue'] = EventQueue(
+        app, db, workers=app.config['WEBHOOK_WORKERS'])
+    services['track_store'] = TrackStore(
+        db, TTLCache(maxsize=app.config['TRACK_CACHE_SIZE'],
+                     ttl=app.config['TRACK_MAX_AGE']),
+        max_age=app.config['TRACK_MAX_AGE'])
+    services['counters'] = CounterBuffer(
+        app, db, interval=app.config['COUNTER_FLUSH_INTERVAL'],
+        max_pending=app.config['COUNTER_FLUSH_SIZE'])
+
+    from project import broadcast, profiles, schema, search, stats
+    from project.views import project_blueprint
+
+    app.register_blueprint(project_blueprint)
+    for command in (broadcast.broadcast_command,
+                    broadcast.broadcast_resume_command,
+                    profiles.refresh_profiles_command,
+                    schema.upgrade_db_command,
+                    search.index_songs_command,
+                    stats.reconcile_stats_command):
+        app.cli.add_command(command)
+    services['bot'].profile_fallback = profiles.stored_profile
+
+    services['counters'].start()
+    return app
+
+
+def start_workers(app):
+    """Start the webhook queue workers of a serving process, which also
+    replay events a previous process left unprocessed. Only for processes
+    that serve webhooks, eg: from a gunicorn `post_worker_init` hook, never
+    from CLI commands.
+    """
+    if app.config['WEBHOOK_ASYNC']:
+        from project.views import handle_message
+        app.extensions['fbc']['event_queue'].start(handle_message)
+
+
+def _stats(name, attribute=None):
+    def stats():
+        service = current_app.extensions['fbc'][name]
+        if attribute is not None:
+            service = getattr(service, attribute)
+        return service.stats()
+    return stats
+
+
+metrics.stats_gauges('fbc_component', 'Queue, cache and counter stats.',
+                     'component', {
+                         'event_queue': _stats('event_queue'),
+                         'search_cache': _stats('search_cache'),
+                         'track_cache': _stats('track_store', 'cache'),
+                         'profile_cache': _stats('bot', 'profile_cache'),
+                         'seen_events': _stats('seen_events'),
+                         'counters': _stats('counters'),
+                         'graph_transport': _stats('transport'),
+                     })
+
+metrics.stats_gauges('fbc_circuit_breaker',
+                     'Circuit state (0 closed, 1 half open, 2 open), '
+                     'consecutive failures, times opened and rejected calls.',
+                     'upstream', {
+                         'graph': _stats('graph_breaker'),
+                         'musixmatch': _stats('musixmatch', 'breaker'),
+                     })
+metrics.stats_gauges('fbc_musixmatch_quota',
+                     'Musixmatch quota over the current window, all keys.',
+                     'client', {'musixmatch': _stats('musixmatch', 'budget')})
 
 from .models import User
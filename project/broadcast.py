@@ -0,0 +1,193 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from fb import NotificationType
+from project import db, bot
+from project.models import Broadcast, User
+from resilience import HALF_OPEN, CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+# Seconds between retries while a circuit trial call is in flight
+TRIAL_WAIT = 0.05
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket allowing `rate` calls per second with
+    bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_broadcast(message, notification_type=NotificationType.regular):
+    """Store a broadcast of a Send API `message` <dict> to every user."""
+    broadcast = Broadcast(message=json.dumps(message),
+                          notification_type=notification_type.value)
+    db.session.add(broadcast)
+    db.session.commit()
+    return broadcast
+
+
+def run_broadcast(broadcast_id, rate=50, concurrency=8, chunk_size=500):
+    """Send (or resume) a broadcast.
+
+    Recipients are streamed from `users` in keyset-ordered chunks and sent
+    through a token bucket by `concurrency` threads. Progress is
+    checkpointed after every chunk, so a resumed broadcast repeats at most
+    one chunk. Once the Graph API circuit is open nothing more is sent: the
+    broadcast is left `paused`, checkpointed before the first recipient that
+    was not attempted. Returns the final status, counters and throughput.
+    """
+    broadcast = Broadcast.query.get(broadcast_id)
+    message = json.loads(broadcast.message)
+    notification_type = NotificationType(broadcast.notification_type)
+    bucket = TokenBucket(rate)
+    # Resolved here, the sending threads have no app context
+    sender = bot._get_current_object()
+    broadcast.status = 'running'
+    db.session.commit()
+    circuit_open = threading.Event()
+
+    def send(recipient_id):
+        """True when sent, False when it failed, None when not attempted
+        because the Graph API circuit is open.
+        """
+        bucket.acquire()
+        while not circuit_open.is_set():
+            try:
+                result = sender.send_message(recipient_id, message,
+                                             notification_type)
+            except CircuitOpen:
+                if sender.transport.breaker.state != HALF_OPEN:
+                    circuit_open.set()
+                    break
+                # Another thread's trial call decides, wait for it
+                time.sleep(TRIAL_WAIT)
+                continue
+            except Exception:
+                logger.exception('Broadcast %s to %s failed',
+                                 broadcast_id, recipient_id)
+                return False
+            return not (isinstance(result, dict) and result.get('error'))
+        return None
+
+    started = time.time()
+    sent = failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            recipients = [row.recipient_id for row in db.session.query(
+                User.recipient_id).filter(
+                    User.recipient_id > broadcast.last_recipient_id).order_by(
+                        User.recipient_id).limit(chunk_size)]
+            if not recipients:
+                break
+            results = list(executor.map(send, recipients))
+            chunk_sent = results.count(True)
+            chunk_failed = results.count(False)
+            sent += chunk_sent
+            failed += chunk_failed
+            broadcast.sent += chunk_sent
+            broadcast.failed += chunk_failed
+            if None in results:
+                # Never checkpoint past a recipient that was not attempted
+                attempted = results.index(None)
+                if attempted:
+                    broadcast.last_recipient_id = recipients[attempted - 1]
+                broadcast.status = 'paused'
+            else:
+                broadcast.last_recipient_id = recipients[-1]
+            broadcast.updated_at = datetime.utcnow()
+            db.session.commit()
+            report = progress(sent, failed, started)
+            logger.info('Broadcast %s: %d sent, %d failed, %.1f msg/s, '
+                        '%.1f%% errors', broadcast_id, broadcast.sent,
+                        broadcast.failed, report['throughput'],
+                        report['error_rate'] * 100)
+            if broadcast.status == 'paused':
+                logger.warning('Broadcast %s paused: Graph API circuit open',
+                               broadcast_id)
+                return dict(report, status=broadcast.status)
+    broadcast.status = 'done'
+    db.session.commit()
+    return dict(progress(sent, failed, started), status=broadcast.status)
+
+
+def progress(sent, failed, started):
+    elapsed = max(time.time() - started, 1e-6)
+    total = sent + failed
+    return {
+        'sent': sent,
+        'failed': failed,
+        'elapsed': elapsed,
+        'throughput': total / elapsed,
+        'error_rate': float(failed) / total if total else 0.0,
+    }
+
+
+@click.command('broadcast')
+@with_appcontext
+@click.argument('text')
+@click.option('--notification-type', default=NotificationType.regular.name,
+              type=click.Choice([item.name for item in NotificationType]))
+@click.option('--rate', default=None, type=float,
+              help='Max messages per second.')
+@click.option('--concurrency', default=None, type=int)
+def broadcast_command(text, notification_type, rate, concurrency):
+    """Send a text message to every user."""
+    broadcast = create_broadcast({'text': text},
+                                 NotificationType[notification_type])
+    click.echo('Broadcast {0} created'.format(broadcast.id))
+    _run(broadcast.id, rate, concurrency)
+
+
+@click.command('broadcast-resume')
+@with_appcontext
+@click.argument('broadcast_id', type=int)
+@click.option('--rate', default=None, type=float)
+@click.option('--concurrency', default=None, type=int)
+def broadcast_resume_command(broadcast_id, rate, concurrency):
+    """Resume an interrupted broadcast from its last checkpoint."""
+    _run(broadcast_id, rate, concurrency)
+
+
+def _run(broadcast_id, rate, concurrency):
+    report = run_broadcast(
+        broadcast_id,
+        rate=rate or current_app.config['BROADCAST_RATE'],
+        concurrency=concurrency or current_app.config[
+            'BROADCAST_CONCURRENCY'],
+        chunk_size=current_app.config['BROADCAST_CHUNK_SIZE'])
+    click.echo('{sent} sent, {failed} failed in {elapsed:.1f}s '
+               '({throughput:.1f} msg/s, {error_rate:.1%} errors)'.format(
+                   **report))
+    if report['status'] == 'paused':
+        click.echo('Paused while the Graph API circuit is open, resume with: '
+                   'flask broadcast-resume {0}'.format(broadcast_id))
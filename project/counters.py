@@ -0,0 +1,147 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from project.models import Song, User
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer(object):
+    """Write-behind buffer for `Song.searched_times` and
+    `User.last_connection`.
+
+    Increments for the same track and touches for the same user are merged
+    in memory and written with one batched UPDATE per table every
+    `interval` seconds, or as soon as `max_pending` keys are buffered. The
+    buffer is flushed at interpreter exit; a crash loses at most
+    `interval` seconds or `max_pending` keys worth of updates, whichever
+    comes first.
+    """
+
+    def __init__(self, app, db, interval=5, max_pending=1000):
+        """
+            @required:
+                app: Flask application, used for the flush app context
+                db: Flask-SQLAlchemy handle
+            @optional:
+                interval: max seconds between flushes
+                max_pending: buffered keys that trigger an early flush
+        """
+        self.app = app
+        self.db = db
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._increments = Counter()
+        self._touches = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+            self._thread = None
+        self.flush()
+
+    def increment(self, track_id, amount=1):
+        with self._lock:
+            self._increments[track_id] += amount
+            self._check_size()
+
+    def touch(self, recipient_id, when=None):
+        when = when or datetime.utcnow()
+        with self._lock:
+            previous = self._touches.get(recipient_id)
+            if previous is None or previous < when:
+                self._touches[recipient_id] = when
+            self._check_size()
+
+    def pending(self):
+        with self._lock:
+            return len(self._increments) + len(self._touches)
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'failed_flushes': self.failed_flushes,
+        }
+
+    def flush(self):
+        """Write everything buffered so far; returns rows written."""
+        with self._lock:
+            increments, self._increments = self._increments, Counter()
+            touches, self._touches = self._touches, {}
+        if not increments and not touches:
+            return 0
+        with self.app.app_context():
+            session = self.db.session
+            try:
+                if increments:
+                    songs = Song.__table__
+                    session.execute(
+                        songs.update().where(
+                            songs.c.track_id == bindparam('_track_id')
+                        ).values(searched_times=songs.c.searched_times +
+                                 bindparam('_amount')),
+                        [{'_track_id': track_id, '_amount': amount}
+                         for track_id, amount in increments.items()])
+                if touches:
+                    users = User.__table__
+                    session.execute(
+                        users.update().where(
+                            (users.c.recipient_id == bindparam('_user_id')) &
+                            ((users.c.last_connection < bindparam('_when')) |
+                             (users.c.last_connection.is_(None)))
+                        ).values(last_connection=bindparam('_when')),
+                        [{'_user_id': user_id, '_when': when}
+                         for user_id, when in touches.items()])
+                session.commit()
+            except Exception:
+                session.rollback()
+                self.failed_flushes += 1
+                logger.exception('Counter flush failed, keeping updates')
+                self._restore(increments, touches)
+                return 0
+            finally:
+                session.remove()
+        rows = len(increments) + len(touches)
+        self.flushes += 1
+        self.flushed_rows += rows
+        return rows
+
+    def _check_size(self):
+        if len(self._increments) + len(self._touches) >= self.max_pending:
+            self._wakeup.set()
+
+    def _restore(self, increments, touches):
+        with self._lock:
+            self._increments.update(increments)
+            for recipient_id, when in touches.items():
+                previous = self._touches.get(recipient_id)
+                if previous is None or previous < when:
+                    self._touches[recipient_id] = when
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
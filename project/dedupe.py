@@ -0,0 +1,44 @@
+from project import seen_events
+from project.metrics import WEBHOOK_DUPLICATES
+
+
+def event_key(message):
+    """Stable id of a messaging event across Facebook redeliveries: the
+    message `mid` or, for postbacks without one, the sender, timestamp and
+    postback. None when the event cannot be identified.
+    """
+    for kind in ('message', 'postback'):
+        body = message.get(kind)
+        if not body:
+            continue
+        if body.get('mid'):
+            return 'seen:mid:{0}'.format(body['mid'])
+        if kind == 'postback' and message.get('timestamp'):
+            return 'seen:postback:{0}:{1}:{2}:{3}'.format(
+                message.get('sender', {}).get('id'), message['timestamp'],
+                body.get('title'), body.get('payload'))
+    return None
+
+
+def drop_redelivered(messages):
+    """New messages: events already seen within DEDUPE_TTL are left out
+    and counted, the rest are marked as seen.
+    """
+    fresh = []
+    for message in messages:
+        key = event_key(message)
+        if key is None or seen_events.add(key, True):
+            fresh.append(message)
+        else:
+            WEBHOOK_DUPLICATES.inc(kind=key.split(':')[1])
+    return fresh
+
+
+def forget(messages):
+    """Let redeliveries of events that did not complete be processed
+    again.
+    """
+    for message in messages:
+        key = event_key(message)
+        if key is not None:
+            seen_events.delete(key)
@@ -0,0 +1,69 @@
+from sqlalchemy import and_, exists, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from project import db
+from project.models import Song, favorites
+
+
+def is_favorite(recipient_id, track_id):
+    """Index-only lookup on the (user, song) unique constraint."""
+    return db.session.query(exists().where(and_(
+        favorites.c.users_recipient_id == recipient_id,
+        favorites.c.songs_track_id == track_id))).scalar()
+
+
+def favorite_songs_page(recipient_id, after=None, limit=50):
+    """One keyset page of the user's favorites in track id order as
+    (track_id, track_name, artist_name) rows. Pass the last track id of
+    a page as `after` to read the next one; each page is a single joined
+    range scan on the (user, song) unique index.
+    """
+    songs = Song.__table__
+    query = db.session.query(
+        songs.c.track_id, songs.c.track_name, songs.c.artist_name
+    ).select_from(favorites.join(
+        songs, songs.c.track_id == favorites.c.songs_track_id)).filter(
+            favorites.c.users_recipient_id == recipient_id)
+    if after is not None:
+        query = query.filter(favorites.c.songs_track_id > after)
+    return query.order_by(favorites.c.songs_track_id).limit(limit).all()
+
+
+def add_favorite(recipient_id, track_id, counters=None):
+    """Add `track_id` to the user's favorites, or bump the song's
+    `searched_times` when it already is one, in a single upsert.
+    With a `CounterBuffer` the bump is handed to the buffer instead.
+    Both the `users` and `songs` rows must already be flushed.
+    Returns True when the favorite was newly added.
+    """
+    values = {'users_recipient_id': recipient_id,
+              'songs_track_id': track_id}
+    songs = Song.__table__
+    postgresql = db.session.get_bind().dialect.name == 'postgresql'
+    if counters is not None:
+        insert = (pg_insert(favorites).on_conflict_do_nothing()
+                  if postgresql else
+                  favorites.insert().prefix_with('OR IGNORE'))
+        inserted = db.session.execute(insert.values(**values))
+        if not inserted.rowcount:
+            counters.increment(track_id)
+        return bool(inserted.rowcount)
+    if postgresql:
+        inserted = pg_insert(favorites).values(
+            **values).on_conflict_do_nothing().returning(
+                favorites.c.songs_track_id).cte('inserted')
+        bumped = db.session.execute(
+            songs.update().where(and_(
+                songs.c.track_id == track_id,
+                ~exists(select([literal_column('1')]).select_from(
+                    inserted)))).values(
+                        searched_times=songs.c.searched_times + 1))
+        return bumped.rowcount == 0
+    inserted = db.session.execute(
+        favorites.insert().prefix_with('OR IGNORE').values(**values))
+    if inserted.rowcount:
+        return True
+    db.session.execute(
+        songs.update().where(songs.c.track_id == track_id).values(
+            searched_times=songs.c.searched_times + 1))
+    return False
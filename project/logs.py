@@ -0,0 +1,47 @@
+import atexit
+import logging
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from six.moves import queue
+
+
+class SamplingFilter(logging.Filter):
+    """Let through a `rate` fraction of records below WARNING."""
+
+    def __init__(self, rate):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def setup_logging(app, sample_rate, maxsize=10000):
+    """Route `app.logger` through a bounded queue drained by a background
+    listener, so request threads never wait on the log handlers. Records
+    are dropped when the queue is full.
+    """
+    if any(isinstance(handler, _DroppingQueueHandler)
+           for handler in app.logger.handlers):
+        # Logger shared with an app created earlier in this process
+        return None
+    log_queue = queue.Queue(maxsize)
+    handler = _DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rate))
+    listener = QueueListener(log_queue, *app.logger.handlers,
+                             respect_handler_level=True)
+    app.logger.handlers = [handler]
+    if app.logger.level == logging.NOTSET:
+        app.logger.setLevel(logging.INFO)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class _DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
@@ -0,0 +1,230 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(
+        name, value.replace('\\', r'\\').replace('"', r'\"').replace(
+            '\n', r'\n')) for name, value in pairs) + '}'
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, counts[:], total, count) for key, (
+                counts, total, count) in sorted(self._values.items())]
+        for key, counts, total, count in values:
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield (self.name + '_bucket', _format_labels(
+                    self.labelnames, key, [('le', repr(float(bound)))]),
+                    bucket_count)
+            yield (self.name + '_bucket', _format_labels(
+                self.labelnames, key, [('le', '+Inf')]), count)
+            yield self.name + '_sum', _format_labels(
+                self.labelnames, key), total
+            yield self.name + '_count', _format_labels(
+                self.labelnames, key), count
+
+
+class Gauges(object):
+    """Gauges read from a callback returning {labels tuple: value}."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in sorted(self.collect().items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {0} {1}'.format(
+                metric.name, metric.documentation))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+WEBHOOK_PARSE = REGISTRY.register(Histogram(
+    'fbc_webhook_parse_seconds',
+    'Webhook size and signature checks plus JSON parsing.'))
+WEBHOOK_EVENTS = REGISTRY.register(Counter(
+    'fbc_webhook_events_total', 'Webhook messaging events by type.',
+    ['kind', 'name']))
+WEBHOOK_DUPLICATES = REGISTRY.register(Counter(
+    'fbc_webhook_duplicates_total',
+    'Redelivered webhook events dropped before processing.', ['kind']))
+ERRORS = REGISTRY.register(Counter(
+    'fbc_errors_total', 'Errors by stage and exception type.',
+    ['stage', 'error']))
+GRAPH_REQUEST = REGISTRY.register(Histogram(
+    'fbc_graph_request_seconds', 'Graph API calls made by fb.Bot.',
+    ['endpoint', 'status']))
+MUSIXMATCH_REQUEST = REGISTRY.register(Histogram(
+    'fbc_musixmatch_request_seconds', 'Musixmatch API calls.',
+    ['method', 'status']))
+MUSIXMATCH_QUOTA = REGISTRY.register(Counter(
+    'fbc_musixmatch_quota_total',
+    'Musixmatch quota spent or requests shed, by priority class.',
+    ['priority', 'outcome']))
+DB_QUERY = REGISTRY.register(Histogram(
+    'fbc_db_query_seconds', 'Database statements.', ['statement']))
+DB_COMMIT = REGISTRY.register(Histogram(
+    'fbc_db_commit_seconds', 'Database session commits.'))
+DB_CONNECTIONS = REGISTRY.register(Counter(
+    'fbc_db_connections_total',
+    'Pool connections opened, checked out and invalidated.', ['event']))
+
+
+def graph_endpoint(url):
+    """Low cardinality label for a Graph API url."""
+    path = url.split('?', 1)[0].rstrip('/').split('/')
+    if path[-1].startswith('v') and path[-1][1:2].isdigit():
+        return 'batch'
+    if path[-2:-1] == ['me']:
+        return path[-1]
+    return 'user_profile'
+
+
+def observe_graph(method, url, status, elapsed):
+    """`fb.Transport` observer feeding GRAPH_REQUEST."""
+    GRAPH_REQUEST.observe(elapsed, endpoint=graph_endpoint(url),
+                          status=status or 'error')
+
+
+def instrument_engine(engine):
+    """Time every statement on `engine` and count its pool connections."""
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        conn.info.setdefault('query_started', []).append(time.time())
+
+    def after_cursor_execute(conn, cursor, statement, *args):
+        started = conn.info['query_started'].pop()
+        DB_QUERY.observe(time.time() - started,
+                         statement=statement.split(None, 1)[0].upper())
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    for name in ('connect', 'checkout', 'invalidate'):
+        event.listen(engine, name, _count_pool_event(name))
+
+
+def _count_pool_event(name):
+    def count(*args):
+        DB_CONNECTIONS.inc(event=name)
+    return count
+
+
+def instrument_session(session):
+    """Time every commit of `session`."""
+
+    def before_commit(db_session):
+        db_session.info['commit_started'] = time.time()
+
+    def after_commit(db_session):
+        started = db_session.info.pop('commit_started', None)
+        if started is not None:
+            DB_COMMIT.observe(time.time() - started)
+
+    event.listen(session, 'before_commit', before_commit)
+    event.listen(session, 'after_commit', after_commit)
+
+
+def stats_gauges(name, documentation, label, sources):
+    """Register gauges from `stats()` dicts, eg: queue depth and lag.
+    `sources` maps a label value to a callable returning a stats <dict>.
+    """
+
+    def collect():
+        values = {}
+        for source, stats in sources.items():
+            for key, value in stats().items():
+                if isinstance(value, (int, float)):
+                    values[(source, key)] = value
+        return values
+    return REGISTRY.register(Gauges(name, documentation, [label, 'stat'],
+                                    collect))
@@ -9,7 +9,9 @@ favorites = db.Table('favorites',
                                db.ForeignKey('songs.track_id')),
                      db.UniqueConstraint(
                          'users_recipient_id', 'songs_track_id',
-                         name='UC_user_id_song_id')
+                         name='UC_user_id_song_id'),
+                     db.Index('ix_favorites_song_id_user_id',
+                              'songs_track_id', 'users_recipient_id')
                      )
 
 
@@ -42,6 +44,7 @@ class Song(db.Model):
     track_name = db.Column(db.String(120))
     artist_name = db.Column(db.String(120))
     searched_times = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     users_list = db.relationship(
         'User',
         secondary=favorites,
@@ -52,6 +55,66 @@ class Song(db.Model):
         self.track_name = track_name
         self.artist_name = artist_name
         self.searched_times = 1
+        self.updated_at = datetime.utcnow()
 
     def __repr__(self):
         return '<Song %r>' % (self.track_name)
+
+
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+    id = db.Column(db.Integer, primary_key=True)
+    sender_id = db.Column(db.String(18), index=True)
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(10), default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, sender_id, payload):
+        self.sender_id = sender_id
+        self.payload = payload
+        self.status = 'pending'
+        self.attempts = 0
+
+    def __repr__(self):
+        return '<OutboxEvent %r>' % (self.id)
+
+
+class ReportStat(db.Model):
+    __tablename__ = 'report_stats'
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+        self.updated_at = datetime.utcnow()
+
+    def __repr__(self):
+        return '<ReportStat %r=%r>' % (self.name, self.value)
+
+
+class Broadcast(db.Model):
+    __tablename__ = 'broadcasts'
+    id = db.Column(db.Integer, primary_key=True)
+    message = db.Column(db.Text)
+    notification_type = db.Column(db.String(12))
+    status = db.Column(db.String(10), default='pending')
+    last_recipient_id = db.Column(db.String(18), default='')
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, message, notification_type):
+        self.message = message
+        self.notification_type = notification_type
+        self.status = 'pending'
+        self.last_recipient_id = ''
+        self.sent = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return '<Broadcast %r>' % (self.id)
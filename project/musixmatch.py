@@ -0,0 +1,271 @@
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from project.metrics import (
+    ERRORS, MUSIXMATCH_QUOTA, MUSIXMATCH_REQUEST)
+from resilience import hedged, remaining
+
+# Priority classes: user searches, the lookup of a song being added to
+# favorites, and refreshes of stored metadata
+SEARCH = 'search'
+LOOKUP = 'lookup'
+ENRICH = 'enrich'
+# Share of each key's quota a priority class may use, lower priorities
+# are shed first as the window fills up
+PRIORITY_SHARES = {SEARCH: 1.0, LOOKUP: 0.9, ENRICH: 0.7}
+# Musixmatch header status codes for an exhausted or rejected key
+QUOTA_STATUS_CODES = (401, 402)
+
+
+class MusixmatchError(Exception):
+    pass
+
+
+class QuotaExceeded(MusixmatchError):
+    pass
+
+
+class SlidingWindow(object):
+    """Approximate count of events in the last `window` seconds, kept in
+    `buckets` fixed time slices so memory does not grow with the quota.
+    """
+
+    def __init__(self, window, buckets=96):
+        self.window = window
+        self.resolution = float(window) / buckets
+        self._buckets = deque()
+        self.total = 0
+
+    def count(self, now):
+        horizon = now - self.window
+        while self._buckets and self._buckets[0][0] <= horizon:
+            self.total -= self._buckets.popleft()[1]
+        return self.total
+
+    def add(self, now, amount=1):
+        start = now - now % self.resolution
+        if self._buckets and self._buckets[-1][0] == start:
+            self._buckets[-1][1] += amount
+        else:
+            self._buckets.append([start, amount])
+        self.total += amount
+
+
+class RedisWindow(object):
+    """SlidingWindow counted in Redis, one INCR'd key per time slice, so
+    every worker shares it and it survives restarts and deploys.
+    """
+
+    def __init__(self, client, name, window, buckets=96):
+        self.client = client
+        self.name = name
+        self.window = window
+        self.buckets = buckets
+        self.resolution = float(window) / buckets
+
+    def count(self, now):
+        last = int(now // self.resolution)
+        values = self.client.mget([self._key(index) for index in range(
+            last - self.buckets + 1, last + 1)])
+        return sum(int(value) for value in values if value is not None)
+
+    def add(self, now, amount=1):
+        key = self._key(int(now // self.resolution))
+        pipeline = self.client.pipeline()
+        pipeline.incrby(key, amount)
+        pipeline.expire(key, int(self.window + self.resolution) + 1)
+        pipeline.execute()
+
+    def _key(self, index):
+        return '{0}:{1}'.format(self.name, index)
+
+
+class QuotaBudget(object):
+    """Per key request budget over a sliding window.
+
+    `acquire(priority)` returns the key with the most quota left that the
+    priority class may still use, or raises QuotaExceeded so low priority
+    work is shed before it can starve user searches. With a Redis
+    `backend` the counts are shared by every worker and kept across
+    restarts, otherwise they are kept per process.
+    """
+
+    def __init__(self, keys, limit, window, cooldown=3600, backend=None):
+        """
+            @required:
+                keys: Musixmatch API keys
+                limit: requests allowed per key in `window`
+                window: seconds, eg: 86400 for a daily cap
+            @optional:
+                cooldown: seconds a key rejected by Musixmatch is skipped
+                backend: `cache.RedisBackend` holding the counts
+        """
+        self.keys = list(keys)
+        self.limit = limit
+        if backend is None:
+            self.windows = dict(
+                (key, SlidingWindow(window)) for key in self.keys)
+        else:
+            # Named after a digest, API keys are not written to Redis
+            self.windows = dict((key, RedisWindow(
+                backend.client, '{0}quota:{1}'.format(
+                    backend.prefix,
+                    hashlib.sha1(key.encode('utf8')).hexdigest()[:16]),
+                window)) for key in self.keys)
+        self.disabled_until = dict((key, 0) for key in self.keys)
+        self.cooldown = cooldown
+        self.shed = dict((priority, 0) for priority in PRIORITY_SHARES)
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=SEARCH):
+        allowed = self.limit * PRIORITY_SHARES[priority]
+        now = time.time()
+        with self._lock:
+            best, best_used = None, None
+            for key in self.keys:
+                if self.disabled_until[key] > now:
+                    continue
+                used = self.windows[key].count(now)
+                if used < allowed and (best is None or used < best_used):
+                    best, best_used = key, used
+            if best is None:
+                self.shed[priority] += 1
+                MUSIXMATCH_QUOTA.inc(priority=priority, outcome='shed')
+                raise QuotaExceeded(
+                    'No Musixmatch quota left for {0}'.format(priority))
+            self.windows[best].add(now)
+        MUSIXMATCH_QUOTA.inc(priority=priority, outcome='spent')
+        return best
+
+    def reject(self, key):
+        """Skip `key` for a while after Musixmatch refused it."""
+        with self._lock:
+            self.disabled_until[key] = time.time() + self.cooldown
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            used = sum(window.count(now) for window in self.windows.values())
+            available = [key for key in self.keys
+                         if self.disabled_until[key] <= now]
+            stats = {
+                'keys': len(self.keys),
+                'keys_available': len(available),
+                'limit': self.limit * len(self.keys),
+                'used': used,
+                'remaining': max(0, self.limit * len(available) - sum(
+                    self.windows[key].count(now) for key in available)),
+            }
+            for priority, shed in self.shed.items():
+                stats['shed_' + priority] = shed
+            return stats
+
+
+def observe(method, url, status, elapsed):
+    """`fb.Transport` observer feeding MUSIXMATCH_REQUEST."""
+    MUSIXMATCH_REQUEST.observe(
+        elapsed, method=url.split('?', 1)[0].rsplit('/', 1)[-1],
+        status=status or 'error')
+
+
+def normalize_query(searched_word):
+    """Case and whitespace insensitive cache key for a search."""
+    return ' '.join(searched_word.lower().split())
+
+
+class Musixmatch(object):
+    """Musixmatch API client for one app, built by `create_app`: every
+    call spends quota from `budget` and goes through `transport` (and its
+    circuit breaker) within the request deadline.
+    """
+
+    def __init__(self, api_url, transport, budget, hedge_delay=0,
+                 reply_reserve=0, executor=None):
+        """
+            @required:
+                api_url: Musixmatch API root
+                transport: `fb.Transport` for Musixmatch, with a breaker
+                budget: QuotaBudget over the API keys
+            @optional:
+                hedge_delay: seconds before a duplicate search GET is
+                    sent, 0 disables hedging
+                reply_reserve: seconds of the deadline left for the reply
+                executor: runs hedged GETs, required when hedge_delay > 0
+        """
+        self.api_url = api_url
+        self.transport = transport
+        self.breaker = transport.breaker
+        self.budget = budget
+        self.hedge_delay = hedge_delay
+        self.reply_reserve = reply_reserve
+        self.executor = executor
+
+    def call(self, method, priority=SEARCH, **parameters):
+        """Body of a Musixmatch API response. Any upstream failure,
+        including an open circuit, the request deadline running out or no
+        quota left for `priority`, is raised as MusixmatchError.
+        """
+        api_url = '{0}/{1}'.format(self.api_url, method)
+        try:
+            # Worker threads of a hedged call do not see this thread's
+            # deadline
+            timeout = self.transport.attempt_timeout(
+                remaining(self.reply_reserve))
+
+            def get():
+                # Every attempt, hedged or not, spends quota
+                key = self.budget.acquire(priority)
+                return key, self.transport.get(
+                    api_url, params=dict(parameters, apikey=key),
+                    timeout=timeout)
+
+            if self.hedge_delay and priority == SEARCH:
+                key, response = hedged(get, self.hedge_delay, self.executor)
+            else:
+                key, response = get()
+        except QuotaExceeded:
+            ERRORS.inc(stage='musixmatch', error='QuotaExceeded')
+            raise
+        except Exception as error:
+            ERRORS.inc(stage='musixmatch', error=type(error).__name__)
+            raise MusixmatchError('{0} failed: {1!r}'.format(method, error))
+        try:
+            message = json.loads(response.content.decode('utf-8'))['message']
+            status_code = message['header']['status_code']
+        except (ValueError, KeyError, TypeError):
+            status_code = None
+        if status_code in QUOTA_STATUS_CODES:
+            self.budget.reject(key)
+        if response.status_code != 200 or status_code != 200:
+            ERRORS.inc(stage='musixmatch', error='MusixmatchError')
+            raise MusixmatchError('{0} returned {1}/{2}'.format(
+                method, response.status_code, status_code))
+        return message['body']
+
+    def search_tracks(self, q_track, page=1, page_size=None):
+        """One page of search results; all of them if page_size is None."""
+        parameters = {'q_track': q_track}
+        if page_size is not None:
+            parameters.update(page=page, page_size=page_size)
+        return self.call('track.search', SEARCH, **parameters)['track_list']
+
+    def get_track(self, track_id, priority=LOOKUP):
+        return self.call('track.get', priority, track_id=track_id)['track']
+
+
+def client():
+    """The current app's Musixmatch client."""
+    return current_app.extensions['fbc']['musixmatch']
+
+
+def search_tracks(q_track, page=1, page_size=None):
+    return client().search_tracks(q_track, page, page_size)
+
+
+def get_track(track_id, priority=LOOKUP):
+    return client().get_track(track_id, priority)
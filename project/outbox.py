@@ -0,0 +1,185 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from project.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+FAILED = 'failed'
+
+
+class EventQueue(object):
+    """Durable background queue for webhook `messaging` events.
+
+    Events are written to the `outbox_events` table before the webhook
+    returns, then drained by a fixed pool of worker threads. Every sender
+    is pinned to one worker so its events are handled in arrival order.
+    Rows are only deleted once the handler succeeds, so whatever is left
+    as `pending` (or stuck in `processing`) is replayed on the next start.
+    """
+
+    def __init__(self, app, db, workers=4, max_attempts=3, backoff=0.5,
+                 stale_after=300):
+        """
+            @required:
+                app: Flask application, used for worker app contexts
+                db: Flask-SQLAlchemy handle
+            @optional:
+                workers: number of worker threads
+                max_attempts: handler attempts before an event is failed
+                backoff: base delay in seconds between attempts
+                stale_after: seconds after which a `processing` row left
+                    behind by a dead process is considered pending again
+        """
+        self.app = app
+        self.db = db
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.stale_after = stale_after
+        self.handler = None
+        self._inboxes = [queue.Queue() for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._processed = 0
+        self._failed = 0
+
+    def start(self, handler):
+        """Recover unprocessed events and start the worker threads."""
+        self.handler = handler
+        for inbox in self._inboxes:
+            thread = threading.Thread(target=self._run, args=(inbox,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        self.recover()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def recover(self):
+        session = self.db.session
+        with self.app.app_context():
+            stale = datetime.utcnow() - timedelta(seconds=self.stale_after)
+            OutboxEvent.query.filter(
+                OutboxEvent.status == PROCESSING,
+                OutboxEvent.updated_at < stale).update(
+                    {'status': PENDING}, synchronize_session=False)
+            session.commit()
+            rows = session.query(
+                OutboxEvent.id, OutboxEvent.sender_id,
+                OutboxEvent.created_at).filter(
+                    OutboxEvent.status == PENDING).order_by(
+                        OutboxEvent.id).all()
+            session.remove()
+        for event_id, sender_id, created_at in rows:
+            self._dispatch(event_id, sender_id, created_at)
+        if rows:
+            logger.info('Recovered %d pending webhook events', len(rows))
+
+    def enqueue(self, messages):
+        """Persist `messaging` events and hand them to the workers."""
+        session = self.db.session
+        events = []
+        for message in messages:
+            sender_id = message.get('sender', {}).get('id')
+            event = OutboxEvent(sender_id=sender_id,
+                                payload=json.dumps(message))
+            session.add(event)
+            events.append(event)
+        if not events:
+            return []
+        session.commit()
+        for event in events:
+            self._dispatch(event.id, event.sender_id, event.created_at)
+        return [event.id for event in events]
+
+    def stats(self):
+        """Queue depth, oldest pending event age and worker counters."""
+        with self._lock:
+            oldest = min(self._pending.values()) if self._pending else None
+            return {
+                'depth': len(self._pending),
+                'lag_seconds': (
+                    (datetime.utcnow() - oldest).total_seconds()
+                    if oldest is not None else 0.0),
+                'processed': self._processed,
+                'failed': self._failed,
+                'workers': len(self._threads),
+            }
+
+    def _dispatch(self, event_id, sender_id, created_at):
+        shard = zlib.crc32((sender_id or '').encode('utf8')) % self.workers
+        with self._lock:
+            self._pending[event_id] = created_at or datetime.utcnow()
+        self._inboxes[shard].put(event_id)
+
+    def _run(self, inbox):
+        while True:
+            event_id = inbox.get()
+            if event_id is None:
+                break
+            ok = False
+            with self.app.app_context():
+                try:
+                    ok = self._process(event_id)
+                except Exception:
+                    logger.exception('Outbox event %s crashed', event_id)
+                finally:
+                    self.db.session.remove()
+            with self._lock:
+                self._pending.pop(event_id, None)
+                if ok:
+                    self._processed += 1
+                else:
+                    self._failed += 1
+
+    def _process(self, event_id):
+        session = self.db.session
+        claimed = OutboxEvent.query.filter_by(
+            id=event_id, status=PENDING).update(
+                {'status': PROCESSING, 'updated_at': datetime.utcnow()},
+                synchronize_session=False)
+        session.commit()
+        if not claimed:
+            # Already handled by another process after a recovery.
+            return True
+        payload = session.query(OutboxEvent.payload).filter_by(
+            id=event_id).scalar()
+        message = json.loads(payload)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.handler(message)
+            except Exception:
+                session.rollback()
+                logger.exception('Outbox event %s failed (attempt %d/%d)',
+                                 event_id, attempt, self.max_attempts)
+                OutboxEvent.query.filter_by(id=event_id).update(
+                    {'attempts': attempt, 'updated_at': datetime.utcnow()},
+                    synchronize_session=False)
+                session.commit()
+                if attempt < self.max_attempts:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+            else:
+                OutboxEvent.query.filter_by(id=event_id).delete(
+                    synchronize_session=False)
+                session.commit()
+                return True
+        OutboxEvent.query.filter_by(id=event_id).update(
+            {'status': FAILED}, synchronize_session=False)
+        session.commit()
+        return False
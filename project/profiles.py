@@ -0,0 +1,51 @@
+import click
+from datetime import datetime, timedelta
+
+from flask.cli import with_appcontext
+
+from project import db, bot
+from project.models import User
+
+
+def stored_profile(recipient_id):
+    """Profile <dict> built from the `users` row, or None if unknown."""
+    user = db.session.query(User.first_name, User.last_name).filter_by(
+        recipient_id=recipient_id).first()
+    if user is None:
+        return None
+    return {'first_name': user.first_name, 'last_name': user.last_name}
+
+
+def refresh_profiles(since, chunk_size=500):
+    """Re-fetch Graph profiles of users connected after `since` and
+    store changed names. Returns the number of users refreshed.
+    """
+    refreshed = 0
+    last_id = ''
+    while True:
+        users = User.query.filter(
+            User.last_connection >= since,
+            User.recipient_id > last_id).order_by(
+                User.recipient_id).limit(chunk_size).all()
+        if not users:
+            break
+        for user in users:
+            user_info = bot.get_user_info(user.recipient_id, refresh=True)
+            if user_info is None:
+                continue
+            user.first_name = user_info.get('first_name', user.first_name)
+            user.last_name = user_info.get('last_name', user.last_name)
+            refreshed += 1
+        db.session.commit()
+        last_id = users[-1].recipient_id
+    return refreshed
+
+
+@click.command('refresh-profiles')
+@with_appcontext
+@click.option('--days', default=30,
+              help='Only refresh users seen in the last DAYS days.')
+def refresh_profiles_command(days):
+    """Scheduled refresh of cached Graph API user profiles."""
+    since = datetime.utcnow() - timedelta(days=days)
+    click.echo('Refreshed {} profiles'.format(refresh_profiles(since)))
@@ -0,0 +1,48 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+
+from project import db
+
+
+def upgrade_schema(connection):
+    """Add the columns and indexes the models gained to tables created by
+    an earlier version, eg: `songs.updated_at`; `db.create_all` only
+    creates missing tables. Added columns are NULL for existing rows.
+    Returns the names of the columns and indexes added.
+    """
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    quote = connection.dialect.identifier_preparer.quote
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = set(column['name']
+                      for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            connection.execute(text(
+                'ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+                    quote(table.name), quote(column.name),
+                    column.type.compile(dialect=connection.dialect))))
+            added.append('{0}.{1}'.format(table.name, column.name))
+        indexes = set(index['name']
+                      for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+                added.append(index.name)
+    return added
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables, then add missing columns and indexes."""
+    db.create_all()
+    with db.engine.begin() as connection:
+        added = upgrade_schema(connection)
+    click.echo('Added: {0}'.format(', '.join(added)) if added
+               else 'Schema up to date')
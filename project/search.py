@@ -0,0 +1,139 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, literal_column, or_, text
+from sqlalchemy.exc import OperationalError
+
+from project import db
+from project.models import Song
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5("
+    "track_id UNINDEXED, track_name, artist_name, "
+    "tokenize = 'unicode61 remove_diacritics 1')",
+    # Only renames touch the index, searched_times updates do not
+    "CREATE TRIGGER IF NOT EXISTS songs_fts_insert AFTER INSERT ON songs "
+    "BEGIN INSERT INTO songs_fts (track_id, track_name, artist_name) "
+    "VALUES (new.track_id, new.track_name, new.artist_name); END",
+    "CREATE TRIGGER IF NOT EXISTS songs_fts_update "
+    "AFTER UPDATE OF track_name, artist_name ON songs "
+    "BEGIN UPDATE songs_fts SET track_name = new.track_name, "
+    "artist_name = new.artist_name WHERE track_id = old.track_id; END",
+    "CREATE TRIGGER IF NOT EXISTS songs_fts_delete AFTER DELETE ON songs "
+    "BEGIN DELETE FROM songs_fts WHERE track_id = old.track_id; END",
+]
+SQLITE_REBUILD = [
+    "DELETE FROM songs_fts",
+    "INSERT INTO songs_fts (track_id, track_name, artist_name) "
+    "SELECT track_id, track_name, artist_name FROM songs",
+]
+POSTGRES_DOCUMENT = ("lower(coalesce(track_name, '') || ' ' || "
+                     "coalesce(artist_name, ''))")
+POSTGRES_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_songs_search_trgm ON songs "
+    "USING gin ((" + POSTGRES_DOCUMENT + ") gin_trgm_ops)",
+]
+
+_available = {}
+
+
+def install_index(connection, rebuild=False):
+    """Create the search index for the connection's dialect: an FTS5 table
+    kept current by triggers on SQLite, a trigram expression index on
+    Postgres. Returns False when the database has no support for it, in
+    which case `find_songs` falls back to LIKE.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        try:
+            for statement in SQLITE_INDEX:
+                connection.execute(text(statement))
+        except OperationalError:
+            # SQLite built without FTS5
+            return False
+        if rebuild:
+            for statement in SQLITE_REBUILD:
+                connection.execute(text(statement))
+    elif dialect == 'postgresql':
+        for statement in POSTGRES_INDEX:
+            connection.execute(text(statement))
+    else:
+        return False
+    _available.pop(connection.engine.url, None)
+    return True
+
+
+@event.listens_for(Song.__table__, 'after_create')
+def _install_index(target, connection, **kwargs):
+    install_index(connection)
+
+
+def index_available():
+    engine = db.engine
+    if engine.url not in _available:
+        if engine.dialect.name == 'sqlite':
+            _available[engine.url] = bool(db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'songs_fts'"
+            )).scalar())
+        else:
+            _available[engine.url] = engine.dialect.name == 'postgresql'
+    return _available[engine.url]
+
+
+def match_expression(query):
+    """FTS5 query matching every word of `query`, the last as a prefix."""
+    words = ['"{0}"'.format(word.replace('"', '""'))
+             for word in query.split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def find_songs(query, limit, offset=0):
+    """Known songs whose name or artist match every word of `query`, most
+    favorited first, as (track_id, track_name, artist_name) rows.
+    """
+    if not query.split():
+        return []
+    songs = Song.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite' and index_available():
+        return db.session.execute(text(
+            "SELECT s.track_id, s.track_name, s.artist_name "
+            "FROM songs_fts JOIN songs AS s "
+            "ON s.track_id = songs_fts.track_id "
+            "WHERE songs_fts MATCH :match "
+            "ORDER BY s.searched_times DESC, songs_fts.rank "
+            "LIMIT :limit OFFSET :offset"), {
+                'match': match_expression(query),
+                'limit': limit,
+                'offset': offset}).fetchall()
+    if dialect == 'postgresql':
+        document = literal_column(POSTGRES_DOCUMENT)
+        conditions = [document.like(_like(word.lower()), escape='\\')
+                      for word in query.split()]
+    else:
+        conditions = [or_(
+            songs.c.track_name.ilike(_like(word), escape='\\'),
+            songs.c.artist_name.ilike(_like(word), escape='\\'))
+            for word in query.split()]
+    return db.session.query(
+        songs.c.track_id, songs.c.track_name, songs.c.artist_name).filter(
+            *conditions).order_by(
+                songs.c.searched_times.desc(), songs.c.track_id).limit(
+                    limit).offset(offset).all()
+
+
+def _like(word):
+    return '%{0}%'.format(word.replace('\\', '\\\\').replace(
+        '%', '\\%').replace('_', '\\_'))
+
+
+@click.command('index-songs')
+@with_appcontext
+def index_songs_command():
+    """Create or rebuild the local song search index."""
+    with db.engine.begin() as connection:
+        installed = install_index(connection, rebuild=True)
+    click.echo('Search index {0}'.format(
+        'rebuilt' if installed else 'not supported, using LIKE'))
@@ -0,0 +1,153 @@
+import click
+from datetime import datetime, time
+
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.models import ReportStat, User
+
+TOTAL_USERS = 'total_users'
+
+
+def active_key(day):
+    return 'active:{0}'.format(day.isoformat())
+
+
+def today_start():
+    return datetime.combine(datetime.utcnow().date(), time.min)
+
+
+def count_total_users():
+    return User.query.count()
+
+
+def count_active_users(since):
+    return User.query.filter(User.last_connection >= since).count()
+
+
+def total_users():
+    """Precomputed number of users, counted once if never stored."""
+    return _value(TOTAL_USERS, count_total_users)
+
+
+def active_users_today():
+    """Precomputed number of users seen today (UTC)."""
+    start = today_start()
+    return _value(active_key(start.date()),
+                  lambda: count_active_users(start))
+
+
+def user_created(recipient_id):
+    """Account for a user added (and flushed) in the current session."""
+    users_created(1)
+
+
+def users_created(count):
+    """Account for `count` users added (and flushed) in this session."""
+    start = today_start()
+    _increment(TOTAL_USERS, count_total_users, count)
+    _increment(active_key(start.date()), lambda: count_active_users(start),
+               count)
+
+
+def record_visit(recipient_id):
+    """Mark an existing user as connected today.
+
+    Only the first visit of the day writes `last_connection` here, with a
+    conditional UPDATE that also tells whether today's active counter has
+    to be bumped. Returns False for repeat visits, which the caller can
+    hand to the write-behind `CounterBuffer` instead.
+    """
+    start = today_start()
+    users = User.__table__
+    first_visit = db.session.execute(
+        users.update().where(
+            (users.c.recipient_id == recipient_id) &
+            ((users.c.last_connection < start) |
+             (users.c.last_connection.is_(None)))).values(
+                 last_connection=datetime.utcnow())).rowcount
+    if first_visit:
+        _increment(active_key(start.date()),
+                   lambda: count_active_users(start))
+    return bool(first_visit)
+
+
+def record_visits(recipient_ids):
+    """`record_visit` for many existing users with a single UPDATE.
+    Returns the number of first visits of the day.
+    """
+    start = today_start()
+    users = User.__table__
+    first_visits = db.session.execute(
+        users.update().where(
+            users.c.recipient_id.in_(list(recipient_ids)) &
+            ((users.c.last_connection < start) |
+             (users.c.last_connection.is_(None)))).values(
+                 last_connection=datetime.utcnow())).rowcount
+    if first_visits:
+        _increment(active_key(start.date()),
+                   lambda: count_active_users(start), first_visits)
+    return first_visits
+
+
+def reconcile():
+    """Overwrite the stored counters with fresh table counts."""
+    start = today_start()
+    values = {
+        TOTAL_USERS: count_total_users(),
+        active_key(start.date()): count_active_users(start),
+    }
+    for name, value in values.items():
+        stat = ReportStat.query.get(name)
+        if stat is None:
+            db.session.add(ReportStat(name, value))
+        else:
+            stat.value = value
+            stat.updated_at = datetime.utcnow()
+    db.session.commit()
+    return values
+
+
+def _value(name, initial):
+    value = db.session.query(ReportStat.value).filter_by(name=name).scalar()
+    if value is None:
+        value = initial()
+        _insert(name, value)
+        db.session.commit()
+    return value
+
+
+def _increment(name, initial, amount=1):
+    """Bump a counter, seeding it from `initial()` when it is missing.
+    `initial` runs after the triggering change was flushed, so the seed
+    already includes it.
+    """
+    stats = ReportStat.__table__
+    bumped = db.session.execute(
+        stats.update().where(stats.c.name == name).values(
+            value=stats.c.value + amount,
+            updated_at=datetime.utcnow())).rowcount
+    if not bumped and not _insert(name, initial()):
+        db.session.execute(
+            stats.update().where(stats.c.name == name).values(
+                value=stats.c.value + amount,
+                updated_at=datetime.utcnow()))
+
+
+def _insert(name, value):
+    """Insert a counter row in a savepoint; False if it already exists."""
+    try:
+        with db.session.begin_nested():
+            db.session.add(ReportStat(name, value))
+    except IntegrityError:
+        return False
+    return True
+
+
+@click.command('reconcile-stats')
+@with_appcontext
+def reconcile_stats_command():
+    """Periodic reconciliation of report counters against the tables."""
+    for name, value in sorted(reconcile().items()):
+        click.echo('{0}: {1}'.format(name, value))
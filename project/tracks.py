@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from project.models import Song
+from project.musixmatch import ENRICH, LOOKUP, get_track
+
+
+class TrackStore(object):
+    """Read-through track metadata store backed by the `songs` table.
+
+    An in-process cache remembers which tracks are stored and fresh, so
+    lookups of those skip the `songs` table; the table is the durable copy,
+    and Musixmatch `track.get` is only called for tracks that are unknown
+    or older than `max_age` seconds.
+    Refreshes are low priority: when they are shed for quota (or fail) the
+    stored metadata is served and refreshed on a later call. Saved tracks
+    are only cached once their transaction commits.
+    """
+
+    def __init__(self, db, cache, max_age):
+        """
+            @required:
+                db: Flask-SQLAlchemy handle
+                cache: TTLCache of fresh track ids
+                max_age: seconds before stored metadata is refreshed
+        """
+        self.db = db
+        self.cache = cache
+        self.max_age = max_age
+        # Session info key of the tracks saved in the open transaction
+        self._saved_key = 'track_store.saved.{0}'.format(id(self))
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def lookup(self, track_id):
+        """(song or None, fresh) from the cache and the `songs` table. A
+        cached track is fresh without a query, the song is then None.
+        """
+        if self.cached(track_id):
+            return None, True
+        song = Song.query.get(track_id)
+        return song, song is not None and self.fresh(song)
+
+    def cached(self, track_id):
+        """Whether the cache knows `track_id` is stored and fresh."""
+        return self.cache.get(track_id) is not None
+
+    def fresh(self, song):
+        """Whether a stored song needs no refresh from Musixmatch."""
+        if self.cached(song.track_id):
+            return True
+        if self.is_stale(song):
+            return False
+        self._remember(song.track_id, song.updated_at)
+        return True
+
+    def fetch(self, track_id, known=False):
+        """Musixmatch metadata only, safe to call from another thread.
+        Refreshes of `known` tracks are low priority.
+        """
+        return get_track(track_id, ENRICH if known else LOOKUP)
+
+    def save(self, track_id, song, track):
+        """Store fetched `track` metadata, inserting the row if new."""
+        if song is None:
+            song = Song(track_id=track_id,
+                        track_name=track['track_name'],
+                        artist_name=track['artist_name'])
+            try:
+                with self.db.session.begin_nested():
+                    self.db.session.add(song)
+            except IntegrityError:
+                # Inserted concurrently by another request
+                song = Song.query.get(track_id)
+        else:
+            song.track_name = track['track_name']
+            song.artist_name = track['artist_name']
+        song.updated_at = datetime.utcnow()
+        self.db.session.info.setdefault(self._saved_key, []).append(
+            (track_id, song.updated_at))
+        return song
+
+    def is_stale(self, song):
+        if song.updated_at is None:
+            return True
+        return datetime.utcnow() - song.updated_at > timedelta(
+            seconds=self.max_age)
+
+    def _remember(self, track_id, updated_at):
+        age = (datetime.utcnow() - updated_at).total_seconds()
+        ttl = self.max_age - age
+        if ttl > 0:
+            self.cache.set(track_id, True, ttl=ttl)
+
+    def _after_commit(self, session):
+        for track_id, updated_at in session.info.pop(self._saved_key, ()):
+            self._remember(track_id, updated_at)
+
+    def _after_rollback(self, session):
+        # The saved rows may be gone, they are looked up again
+        session.info.pop(self._saved_key, None)
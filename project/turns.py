@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import Future, wait
+
+from flask import current_app
+
+from project.metrics import ERRORS
+from resilience import DeadlineExceeded, bind_deadline, remaining
+
+_local = threading.local()
+
+
+class Turn(object):
+    """Independent I/O calls of one webhook event run at the same time.
+
+    Submitted calls start right away on a shared executor, under the
+    caller's deadline and app context. `join` waits for all of them, for
+    no longer than the deadline allows, before the reply is sent, so the
+    turn takes as long as its slowest call instead of their sum, eg:
+        turn = Turn(executor)
+        turn.submit(bot.send_action, recipient_id, 'typing_on')
+        profile = turn.submit(bot.get_user_info, recipient_id)
+        turn.join()
+        user_info = turn.optional(profile, {})
+    Database work stays in the calling thread. Turns started from a call
+    already running on the executor run their calls inline, so nested
+    turns cannot exhaust the pool waiting on each other.
+    """
+
+    def __init__(self, executor, reserve=0):
+        """
+            @required:
+                executor: shared concurrent.futures executor
+            @optional:
+                reserve: seconds of the deadline `join` leaves for the reply
+        """
+        self.executor = executor
+        self.reserve = reserve
+        self.futures = []
+
+    def submit(self, call, *args, **kwargs):
+        if getattr(_local, 'nested', False):
+            future = Future()
+            try:
+                future.set_result(call(*args, **kwargs))
+            except Exception as error:
+                future.set_exception(error)
+            return future
+        app = current_app._get_current_object()
+        call = bind_deadline(call)
+
+        def run():
+            _local.nested = True
+            try:
+                with app.app_context():
+                    return call(*args, **kwargs)
+            finally:
+                _local.nested = False
+        future = self.executor.submit(run)
+        self.futures.append(future)
+        return future
+
+    def join(self):
+        if not self.futures:
+            return
+        try:
+            left = remaining(self.reserve)
+        except DeadlineExceeded:
+            left = 0
+        wait(self.futures, timeout=left)
+
+    def result(self, future):
+        """Result of a joined call; raises its error, or DeadlineExceeded
+        when it did not finish in time.
+        """
+        if not future.done():
+            raise DeadlineExceeded('Call did not finish before the reply')
+        return future.result()
+
+    def optional(self, future, default=None):
+        """Result of a call the reply can do without, `default` on error."""
+        try:
+            return self.result(future)
+        except Exception as error:
+            ERRORS.inc(stage='turn', error=type(error).__name__)
+            return default
@@ -1,18 +1,38 @@
 import os
-import requests
 import random
 import json
-from datetime import datetime, date
-from flask import Flask, request, Blueprint
+from collections import OrderedDict
+from concurrent.futures import wait
+from flask import (
+    Flask, request, Blueprint, abort, current_app, jsonify)
 
-from project import db, bot
+from fb import (
+    BUTTON_TEXT_LIMIT, GENERIC_ELEMENTS_LIMIT, MessageTemplate,
+    PayloadTooLarge, generic_template, pack_lines, read_payload,
+    read_signed_payload)
+from project import (
+    db, bot, counters, event_queue, search_cache, search_cursors, stats,
+    track_store, turn_executor)
+from project.dedupe import drop_redelivered, forget
+from project.favorites import add_favorite, favorite_songs_page
+from project.metrics import ERRORS, REGISTRY, WEBHOOK_EVENTS, WEBHOOK_PARSE
 from project.models import User, Song
+from project.musixmatch import (
+    MusixmatchError, normalize_query, search_tracks)
+from project.search import find_songs
+from project.turns import Turn
+from resilience import DeadlineExceeded, deadline
 
 
 project_blueprint = Blueprint(
     'home', __name__,
 )
 
+UNAVAILABLE = ('Musixmatch no está disponible en este momento, '
+               'intenta más tarde')
+POSTBACKS = ('Agregar canción', 'Lista de favoritos', 'Mostrar usuarios',
+             'Chats hoy', 'Ver más', 'Más favoritos')
+
 
 @project_blueprint.route('/', methods=['GET'])
 def verify():
@@ -25,128 +45,451 @@ def verify():
 
 @project_blueprint.route('/', methods=['POST'])
 def webhook():
-    output = request.get_json()
-    print(output)
-    for event in output['entry']:
-        messaging = event['messaging']
-        for message in messaging:
-            if message.get('postback'):
-                recipient_id = message['sender']['id']
-                print(message['postback'].get('title'))
-                if 'Agregar canción' == message['postback'].get('title'):
-                    track_id = message['postback'].get('payload')
-                    add_music(recipient_id, track_id)
-                    send_message(recipient_id, 'Canción agregada')
-                if 'Lista de favoritos' == message['postback'].get('title'):
-                    favorite_songs = get_favorite_songs(recipient_id)
-                    print(favorite_songs)
-                    send_message(recipient_id, favorite_songs)
-                if 'Mostrar usuarios' == message['postback'].get('title'):
-                    total_users = get_total_users()
-                    send_message(recipient_id, total_users)
-                if 'Chats hoy' == message['postback'].get('title'):
-                    chats_today = get_total_chats()
-                    send_message(recipient_id, chats_today)
-            if message.get('message'):
-                recipient_id = message['sender']['id']
-                mensaje = message['message'].get('text')
-                if message['message'].get('text'):
-                    if 'buscar:' in mensaje:
-                        results = get_results(
-                            mensaje.split('buscar:')[1].strip())
-                        send_generic_message(recipient_id, results[:3])
-                    if 'Reportes:' in mensaje:
-                        reports = get_reports()
-                        send_generic_message(recipient_id, reports)
+    with WEBHOOK_PARSE.time():
+        output = get_verified_json()
+    current_app.logger.info('webhook %s', output)
+    if current_app.config['WEBHOOK_ASYNC']:
+        if not output or not isinstance(output.get('entry'), list):
+            return "Invalid payload", 400
+        messages = drop_redelivered(
+            [message for event in output['entry']
+             for message in event.get('messaging', [])])
+        try:
+            event_queue.enqueue(messages)
+        except Exception:
+            # Nothing was queued, let the redelivery through
+            forget(messages)
+            raise
+        return "EVENT_RECEIVED", 200
+    messages = drop_redelivered(
+        [message for event in output['entry']
+         for message in event.get('messaging', [])])
+    done = set()
+    try:
+        # Every upstream call of this delivery shares one deadline
+        with deadline(current_app.config['REQUEST_DEADLINE']):
+            if current_app.config['WEBHOOK_BATCH']:
+                handle_delivery(messages, done)
+            else:
+                for message in messages:
+                    handle_message(message)
+                    done.add(id(message))
+    except Exception:
+        # Facebook redelivers failed deliveries, let the unfinished
+        # events through
+        forget([message for message in messages
+                if id(message) not in done])
+        raise
     return "Message Processed"
 
 
-def add_music(recipient_id, track_id):
-    user_info = bot.get_user_info(recipient_id)
+@project_blueprint.route('/queue', methods=['GET'])
+def queue_stats():
+    return jsonify(event_queue.stats())
+
+
+@project_blueprint.route('/counters', methods=['GET'])
+def counter_stats():
+    return jsonify(counters.stats())
+
+
+@project_blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    return current_app.response_class(
+        REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@project_blueprint.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'search': search_cache.stats(),
+        'tracks': track_store.cache.stats(),
+        'profiles': bot.profile_cache.stats(),
+    })
+
+
+def get_verified_json():
+    """Webhook body parsed only after its size and signature are checked.
+    The signature check is skipped when APP_SECRET is not configured.
+    """
+    max_length = current_app.config['WEBHOOK_MAX_BODY']
+    if (request.content_length is not None and
+            request.content_length > max_length):
+        abort(413)
+    app_secret = current_app.config['APP_SECRET']
+    signature = (request.headers.get('X-Hub-Signature-256') or
+                 request.headers.get('X-Hub-Signature'))
+    try:
+        if not app_secret:
+            body = read_payload(request.stream, max_length)
+        else:
+            body = read_signed_payload(
+                app_secret, request.stream, signature, max_length)
+    except PayloadTooLarge:
+        abort(413)
+    if body is None:
+        abort(403)
+    try:
+        return json.loads(body.decode('utf-8'))
+    except ValueError:
+        abort(400)
+
+
+def handle_message(message):
+    kind, name = event_name(message)
+    WEBHOOK_EVENTS.inc(kind=kind, name=name)
+    try:
+        with deadline(current_app.config['REQUEST_DEADLINE']):
+            dispatch_message(message)
+    except Exception as error:
+        ERRORS.inc(stage=name, error=type(error).__name__)
+        current_app.logger.exception('Failed to handle %s', name)
+        raise
+
+
+def handle_delivery(messages, done=None):
+    """Process every messaging event of one webhook delivery together.
+
+    All 'Agregar canción' postbacks are applied first by
+    `add_music_batch`, in one transaction. Then each sender's events run
+    in delivery order, concurrently with other senders: the replies to
+    the added songs and the other events through `handle_message`. The
+    ids of the messages that completed are added to `done`; returns once
+    every sender's events have finished, raising the first error.
+    """
+    done = set() if done is None else done
+    adds = [message for message in messages
+            if event_name(message) == ('postback', 'Agregar canción')]
+    added = add_music_batch(
+        [(message['sender']['id'], message['postback'].get('payload'))
+         for message in adds], new_turn()) if adds else []
+    replies = dict(
+        (id(message), 'Canción agregada' if ok else UNAVAILABLE)
+        for message, ok in zip(adds, added))
+    senders = OrderedDict()
+    for message in messages:
+        senders.setdefault(message.get('sender', {}).get('id'), []).append(
+            message)
+    turn = Turn(turn_executor)
+    futures = [turn.submit(handle_sender_events, events, replies, done)
+               for events in senders.values()]
+    # These tasks are the whole handling, replies included, and their
+    # upstream calls are bounded by the deadline: wait for every one so an
+    # event still running is never taken for failed and forgotten
+    wait(futures)
+    for future in futures:
+        future.result()
+
+
+def handle_sender_events(messages, replies, done):
+    for message in messages:
+        if id(message) not in replies:
+            handle_message(message)
+        else:
+            WEBHOOK_EVENTS.inc(kind='postback', name='Agregar canción')
+            send_message(message['sender']['id'], replies[id(message)])
+        done.add(id(message))
+
+
+def event_name(message):
+    """(kind, name) labels for a messaging event, eg: the postback title.
+    Unknown names are grouped under 'other' to bound label cardinality.
+    """
+    if message.get('postback'):
+        title = message['postback'].get('title')
+        return 'postback', title if title in POSTBACKS else 'other'
+    if message.get('message'):
+        text = message['message'].get('text') or ''
+        if 'buscar:' in text:
+            return 'message', 'buscar'
+        if 'Reportes:' in text:
+            return 'message', 'Reportes'
+        return 'message', 'other'
+    return 'other', 'other'
+
+
+def dispatch_message(message):
+    if message.get('postback'):
+        recipient_id = message['sender']['id']
+        if 'Agregar canción' == message['postback'].get('title'):
+            track_id = message['postback'].get('payload')
+            if add_music(recipient_id, track_id, new_turn()):
+                send_message(recipient_id, 'Canción agregada')
+            else:
+                send_message(recipient_id, UNAVAILABLE)
+        if 'Lista de favoritos' == message['postback'].get('title'):
+            send_favorite_songs(recipient_id)
+        if 'Más favoritos' == message['postback'].get('title'):
+            send_favorite_songs(recipient_id,
+                                message['postback'].get('payload'))
+        if 'Mostrar usuarios' == message['postback'].get('title'):
+            total_users = get_total_users()
+            send_message(recipient_id, total_users)
+        if 'Chats hoy' == message['postback'].get('title'):
+            chats_today = get_total_chats()
+            send_message(recipient_id, chats_today)
+        if 'Ver más' == message['postback'].get('title'):
+            send_next_results(recipient_id)
+    if message.get('message'):
+        recipient_id = message['sender']['id']
+        mensaje = message['message'].get('text')
+        if message['message'].get('text'):
+            if 'buscar:' in mensaje:
+                send_results(recipient_id, normalize_query(
+                    mensaje.split('buscar:')[1]), turn=new_turn())
+            if 'Reportes:' in mensaje:
+                bot.send_template(recipient_id, REPORTS_TEMPLATE)
+
+
+def new_turn():
+    return Turn(turn_executor, current_app.config['REPLY_RESERVE'])
+
+
+def show_typing(turn, recipient_id):
+    """Typing indicator for replies that wait on an upstream call; the
+    turn joins it so it always reaches Messenger before the reply.
+    """
+    turn.submit(bot.send_action, recipient_id, 'typing_on')
+
+
+def add_music(recipient_id, track_id, turn):
+    """Add the track to the user's favorites; False when its metadata
+    could not be fetched from Musixmatch. The profile of a new user and
+    the track metadata are fetched concurrently within `turn`.
+    """
     user = User.query.filter_by(recipient_id=recipient_id).first()
+    song, fresh = track_store.lookup(track_id)
+    if not user or not fresh:
+        show_typing(turn, recipient_id)
+    profile = None
+    if not user:
+        profile = turn.submit(bot.get_user_info, recipient_id)
+    track = None
+    if not fresh:
+        track = turn.submit(track_store.fetch, track_id, song is not None)
+    turn.join()
     # check if user exists in bd
     if not user:
+        # The profile is optional, the user is saved without it
+        user_info = turn.optional(profile) or {}
         user = User(
             recipient_id=recipient_id,
-            first_name=user_info['first_name'],
-            last_name=user_info['last_name'])
+            first_name=user_info.get('first_name'),
+            last_name=user_info.get('last_name'))
         db.session.add(user)
-    else:
+        db.session.flush()
+        stats.user_created(recipient_id)
+        db.session.commit()
+    elif not stats.record_visit(recipient_id):
         # Update user's last conection
-        user.last_connection = datetime.utcnow()
+        counters.touch(recipient_id)
+    if track is not None:
+        try:
+            track_store.save(track_id, song, turn.result(track))
+        except (MusixmatchError, DeadlineExceeded):
+            # Stale metadata is still good enough for a known song
+            if song is None:
+                return False
+    db.session.flush()
+    add_favorite(recipient_id, track_id, counters)
     db.session.commit()
-    parameters = {
-        'apikey': '2df63ad0b5eb5f9d024490851cb059a7',
-        'track_id': track_id,
-    }
-    api_url = 'http://api.musixmatch.com/ws/1.1/track.get'
-    response = requests.get(api_url, params=parameters)
-    results = None
-    if response.status_code == 200:
-        results = json.loads(response.content.decode('utf-8'))
-        track = results['message']['body']['track']
-        song = Song.query.filter_by(track_id=track_id).first()
-        # check if song exist in bd
-        if not song:
-            song = Song(track_id=track_id,
-                        track_name=track['track_name'],
-                        artist_name=track['artist_name'])
-            db.session.add(song)
-        favorite_song = User.query.filter(
-            User.songs_list.any(track_id=track_id)).first()
-        # check if user has song as favorite
-        if favorite_song:
-            favorite_song.searched_times += 1
-        else:
-            user.songs_list.append(song)
-        db.session.commit()
+    return True
+
+
+def add_music_batch(pairs, turn):
+    """`add_music` for many (recipient_id, track_id) pairs at once.
+
+    Users and songs are read with one IN query each, missing profiles and
+    track metadata are fetched concurrently within `turn`, and every
+    change is committed in a single transaction. Returns one bool per
+    pair, False when the track metadata could not be fetched.
+    """
+    recipient_ids = set(recipient_id for recipient_id, _ in pairs)
+    track_ids = set(track_id for _, track_id in pairs)
+    # Tracks the cache knows are stored and fresh need no query
+    cached = set(track_id for track_id in track_ids
+                 if track_store.cached(track_id))
+    known_users = set(recipient_id for recipient_id, in db.session.query(
+        User.recipient_id).filter(User.recipient_id.in_(recipient_ids)))
+    songs = dict((song.track_id, song) for song in Song.query.filter(
+        Song.track_id.in_(track_ids - cached))) if track_ids - cached else {}
+    profiles = dict(
+        (recipient_id, turn.submit(bot.get_user_info, recipient_id))
+        for recipient_id in recipient_ids - known_users)
+    tracks = dict(
+        (track_id, turn.submit(track_store.fetch, track_id,
+                               track_id in songs))
+        for track_id in track_ids - cached
+        if track_id not in songs or not track_store.fresh(songs[track_id]))
+    turn.join()
+    for recipient_id in sorted(profiles):
+        # The profile is optional, the user is saved without it
+        user_info = turn.optional(profiles[recipient_id]) or {}
+        db.session.add(User(
+            recipient_id=recipient_id,
+            first_name=user_info.get('first_name'),
+            last_name=user_info.get('last_name')))
+    if profiles:
+        db.session.flush()
+        stats.users_created(len(profiles))
+    if known_users:
+        stats.record_visits(known_users)
+        for recipient_id in known_users:
+            counters.touch(recipient_id)
+    for track_id, track in tracks.items():
+        try:
+            songs[track_id] = track_store.save(
+                track_id, songs.get(track_id), turn.result(track))
+        except (MusixmatchError, DeadlineExceeded):
+            # Stale metadata is still good enough for a known song
+            pass
+    db.session.flush()
+    stored = cached | set(songs)
+    added = []
+    for recipient_id, track_id in pairs:
+        added.append(track_id in stored)
+        if track_id in stored:
+            add_favorite(recipient_id, track_id, counters)
+    db.session.commit()
+    return added
 
 
 def get_total_chats():
-    start = date.today()
-    total_chats = User.query.filter(User.last_connection >= start).count()
+    total_chats = stats.active_users_today()
     return 'Total chats de hoy: {}'.format(total_chats)
 
 
 def get_total_users():
-    total_users = User.query.count()
+    total_users = stats.total_users()
     return 'Total de usuarios: {}'.format(total_users)
 
 
-def get_favorite_songs(recipient_id):
-    user = User.query.filter_by(recipient_id=recipient_id).first()
-    favorite_songs = ''
-    for song in user.songs_list:
-        favorite_songs += '{} - {}\n'.format(song.track_name, song.artist_name)
-    return favorite_songs
+def send_favorite_songs(recipient_id, after=None):
+    """Send one page of favorites packed into as few messages as fit the
+    text limit. When there are more, the last message carries a
+    'Más favoritos' button whose payload is the page's last track id.
+    """
+    page_size = current_app.config['FAVORITES_PAGE_SIZE']
+    rows = favorite_songs_page(recipient_id, after, page_size + 1)
+    if not rows:
+        send_message(recipient_id, 'No hay más favoritos'
+                     if after else 'No tienes canciones favoritas')
+        return
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    messages = list(pack_lines(
+        '{} - {}'.format(track_name, artist_name)
+        for track_id, track_name, artist_name in rows))
+    last = messages.pop() if more else None
+    if last is not None and len(last) > BUTTON_TEXT_LIMIT:
+        messages.append(last)
+        last = 'Más favoritos'
+    for text in messages:
+        send_message(recipient_id, text)
+    if last is not None:
+        bot.send_button_message(recipient_id, last, [{
+            "type": "postback",
+            "title": "Más favoritos",
+            "payload": rows[-1][0],
+        }])
+
+
+def send_results(recipient_id, query, page=1, source=None, turn=None):
+    """Send one page of results and remember where the user is, so the
+    'Ver más' postback continues the search without starting it again.
+    A new search is answered from the local song index when it knows at
+    least SEARCH_LOCAL_MIN matches and from Musixmatch otherwise. While
+    Musixmatch is unavailable whatever the index knows is sent instead.
+    Calls already running in `turn` are joined before replying.
+    """
+    # One element of the generic template is left for "Ver más"
+    page_size = max(1, min(current_app.config['SEARCH_PAGE_SIZE'],
+                           GENERIC_ELEMENTS_LIMIT - 1))
+    results = []
+    if source is None:
+        local_min = current_app.config['SEARCH_LOCAL_MIN']
+        results = get_local_results(query, 1, max(page_size, local_min))
+        source = 'local' if local_min and len(
+            results) >= local_min else 'musixmatch'
+        results = results[:page_size]
+    unavailable = False
+    if source == 'musixmatch':
+        if turn is not None and not has_results(query, page, page_size):
+            show_typing(turn, recipient_id)
+        remote = get_results(query, page, page_size)
+        if remote is not None:
+            results = remote
+        elif results:
+            source = 'local'
+        else:
+            unavailable = True
+    elif page > 1:
+        results = get_local_results(query, page, page_size)
+    if turn is not None:
+        turn.join()
+    if unavailable:
+        send_message(recipient_id, UNAVAILABLE)
+        return
+    if not results:
+        send_message(recipient_id, 'No hay más resultados'
+                     if page > 1 else 'No se encontraron resultados')
+        return
+    search_cursors.set('cursor:' + recipient_id,
+                       {'query': query, 'page': page, 'source': source})
+    if len(results) == page_size:
+        results = results + [MORE_RESULTS]
+    send_generic_message(recipient_id, results)
+
 
+def send_next_results(recipient_id):
+    cursor = search_cursors.get('cursor:' + recipient_id)
+    if cursor is None:
+        send_message(recipient_id, 'La búsqueda expiró, vuelve a buscar')
+        return
+    send_results(recipient_id, cursor['query'], cursor['page'] + 1,
+                 cursor.get('source', 'musixmatch'))
 
-def get_results(searched_word):
-    parameters = {
-        'apikey': '2df63ad0b5eb5f9d024490851cb059a7',
-        'q_track': searched_word,
+
+def get_local_results(query, page, page_size):
+    return [song_element(track_id, track_name, artist_name)
+            for track_id, track_name, artist_name in find_songs(
+                query, page_size, (page - 1) * page_size)]
+
+
+def results_key(query, page, page_size):
+    return 'search:{0}:{1}:{2}'.format(page, page_size, query)
+
+
+def has_results(query, page, page_size):
+    return search_cache.get(results_key(query, page, page_size)) is not None
+
+
+def get_results(query, page=1, page_size=None):
+    try:
+        return search_cache.get_or_load(
+            results_key(query, page, page_size),
+            lambda: search_songs(query, page, page_size))
+    except MusixmatchError:
+        return None
+
+
+def search_songs(query, page=1, page_size=None):
+    return [song_element(element['track']['track_id'],
+                         element['track']['track_name'],
+                         element['track']['artist_name'])
+            for element in search_tracks(query, page, page_size)]
+
+
+def song_element(track_id, track_name, artist_name):
+    return {
+        "title": track_name,
+        "subtitle": artist_name,
+        "buttons": [{
+            "type": "postback",
+            "title": "Agregar canción",
+            "payload": str(track_id),
+        }],
     }
-    api_url = 'http://api.musixmatch.com/ws/1.1/track.search'
-    response = requests.get(api_url, params=parameters)
-
-    results = None
-    if response.status_code == 200:
-        results = json.loads(response.content.decode('utf-8'))
-        track_list = results['message']['body']['track_list']
-        songs = []
-        for element in track_list:
-            song_info = {
-                "title": element['track']['track_name'],
-                "subtitle": element['track']['artist_name'],
-                "buttons": [{
-                    "type": "postback",
-                    "title": "Agregar canción",
-                    "payload": str(element['track']['track_id']),
-                }],
-            }
-            songs.append(song_info)
-        results = songs
-    return results
 
 
 def get_reports():
@@ -179,6 +522,18 @@ def get_reports():
     return reports
 
 
+REPORTS_TEMPLATE = MessageTemplate(generic_template(get_reports()))
+
+MORE_RESULTS = {
+    "title": 'Más resultados',
+    "buttons": [{
+        "type": "postback",
+        "title": "Ver más",
+        "payload": "True",
+    }],
+}
+
+
 def send_generic_message(recipient_id, elements):
     bot.send_generic_message(recipient_id, elements)
 
@@ -0,0 +1,156 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+import requests
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_local = threading.local()
+
+
+class CircuitOpen(requests.RequestException):
+    pass
+
+
+class DeadlineExceeded(requests.RequestException):
+    pass
+
+
+@contextmanager
+def deadline(seconds):
+    """Bound every upstream call made by this thread inside the block to
+    finish within `seconds`. Nested deadlines never extend an outer one.
+    """
+    previous = getattr(_local, 'deadline', None)
+    expires_at = time.time() + seconds
+    if previous is not None:
+        expires_at = min(previous, expires_at)
+    _local.deadline = expires_at
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def remaining(reserve=0):
+    """Seconds left before this thread's deadline, None without one.
+    `reserve` seconds are kept back, eg: to still send a fallback reply.
+    Raises DeadlineExceeded when no time is left.
+    """
+    expires_at = getattr(_local, 'deadline', None)
+    if expires_at is None:
+        return None
+    left = expires_at - time.time() - reserve
+    if left <= 0:
+        raise DeadlineExceeded('Deadline exceeded')
+    return left
+
+
+def bind_deadline(call):
+    """`call` wrapped to run under the calling thread's deadline, eg: when
+    it is submitted to an executor.
+    """
+    expires_at = getattr(_local, 'deadline', None)
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, 'deadline', None)
+        _local.deadline = expires_at
+        try:
+            return call(*args, **kwargs)
+        finally:
+            _local.deadline = previous
+    return bound
+
+
+class CircuitBreaker(object):
+    """Fail fast while an upstream keeps failing.
+
+    After `failure_threshold` consecutive failures calls are rejected with
+    CircuitOpen for `reset_timeout` seconds; then a single trial call is
+    let through and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        """
+            @required:
+                name: upstream name used in errors and metrics
+            @optional:
+                failure_threshold: consecutive failures that open it
+                reset_timeout: seconds open before a trial call
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0
+        self.rejected = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        """Raise CircuitOpen unless a call may go through now."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen('{0} circuit open'.format(self.name))
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    self.rejected += 1
+                    raise CircuitOpen('{0} circuit open'.format(self.name))
+                self._trial = True
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if (self.state == HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': STATE_VALUES[self.state],
+                'failures': self.failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+def hedged(call, delay, executor):
+    """Run `call()` and, when it has not finished after `delay` seconds,
+    a second identical one; return the first successful result. Only for
+    idempotent calls. Raises the last error when both fail.
+    """
+    first = executor.submit(call)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+    pending = {first, executor.submit(call)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                return future.result()
+            except Exception as exc:
+                error = exc
+    raise error
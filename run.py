@@ -1,5 +1,8 @@
-from project import app
+from project import create_app, start_workers
+
+app = create_app()
 
 
 if __name__ == '__main__':
+    start_workers(app)
     app.run()
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_graph import FakeGraph  # noqa: E402
+
+
+@pytest.fixture
+def graph():
+    """Local fake Graph API, see benchmarks/fake_graph.py."""
+    with FakeGraph() as server:
+        yield server
+
+
+@pytest.fixture
+def make_client(graph, tmpdir):
+    """Build a test client of an app using the fake Graph API and a
+    throwaway SQLite database with its tables; keyword arguments override
+    TestingConfig.
+    """
+    from config import TestingConfig
+    from project import create_app, db
+
+    def make_client(**settings):
+        defaults = {
+            'PAGE_ACCESS_TOKEN': 'token',
+            'APP_SECRET': None,
+            'LOG_SAMPLE_RATE': 0,
+            'ATTACHMENT_REGISTRY_PATH': None,
+            'CACHE_REDIS_URL': None,
+            'WEBHOOK_ASYNC': False,
+            'GRAPH_API_URL': graph.url,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///{0}'.format(
+                tmpdir.join('test.db')),
+        }
+        defaults.update(settings)
+        app = create_app(type('Config', (TestingConfig,), defaults))
+        with app.app_context():
+            db.create_all()
+        return app.test_client()
+    return make_client
@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from fb import Bot, MessageTemplate, NotificationType
+from fb_async import AsyncBot
+
+BUTTONS = [{'type': 'postback', 'title': 'Agregar', 'payload': 'add'}]
+ELEMENTS = [{'title': 'Canción', 'subtitle': 'Artista', 'buttons': BUTTONS}]
+QUICK_REPLIES = [{'content_type': 'text', 'title': 'Sí', 'payload': 'yes'}]
+# (method name, arguments after the recipient id)
+CALLS = [
+    ('send_text_message', ('hola ñandú',)),
+    ('send_text_message', ('silencio', NotificationType.silent_push)),
+    ('send_generic_message', (ELEMENTS,)),
+    ('send_quick_reply', ('¿Seguro?', QUICK_REPLIES)),
+    ('send_button_message', ('Elegí', BUTTONS)),
+    ('send_action', ('typing_on',)),
+    ('send_image_url', ('http://example.com/cover.jpg',)),
+    ('send_template', (MessageTemplate({'text': 'plantilla'}),)),
+]
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.mark.parametrize('name,args', CALLS)
+def test_payloads_match_bot(graph, name, args):
+    bot = Bot('token', graph_url=graph.url)
+    getattr(bot, name)('42', *args)
+    expected = graph.sent.pop()
+
+    async def send():
+        async with AsyncBot('token', graph_url=graph.url) as async_bot:
+            return await getattr(async_bot, name)('42', *args)
+    result = run(send())
+    assert graph.sent.pop() == expected
+    assert result['recipient_id'] == '42'
+
+
+def test_get_user_info_matches_bot(graph):
+    bot = Bot('token', graph_url=graph.url)
+
+    async def get():
+        async with AsyncBot('token', graph_url=graph.url) as async_bot:
+            return await async_bot.get_user_info('42')
+    assert run(get()) == bot.get_user_info('42')
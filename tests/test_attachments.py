@@ -0,0 +1,66 @@
+import pytest
+
+from fake_graph import FakeGraph
+from fb import AttachmentRegistry, Bot
+
+ERRORS = {
+    'blocked': {'message': '(#551) This person isn\'t available right now.',
+                'code': 551},
+    'no_permission': {'message': '(#10) Message sent outside of allowed '
+                                 'window.', 'code': 10},
+    'invalid': {'message': '(#100) Invalid attachment_id', 'code': 100},
+    'upload_failure': {'message': '(#100) Upload attachment failure.',
+                       'code': 100, 'error_subcode': 2018047},
+}
+
+
+class AttachmentGraph(FakeGraph):
+    """Fake Graph API failing sends to recipients named after ERRORS."""
+
+    def __init__(self):
+        super(AttachmentGraph, self).__init__()
+        self.uploads = 0
+
+    def handle(self, method, path, params):
+        if path.endswith('me/message_attachments'):
+            self.uploads += 1
+        recipient = params.get('recipient')
+        if isinstance(recipient, dict) and recipient.get('id') in ERRORS:
+            return 400, {'error': ERRORS[recipient['id']]}
+        return super(AttachmentGraph, self).handle(method, path, params)
+
+
+@pytest.fixture
+def attachment_graph():
+    with AttachmentGraph() as server:
+        yield server
+
+
+@pytest.fixture
+def image(tmpdir):
+    path = tmpdir.join('cover.png')
+    path.write_binary(b'\x89PNG fake image')
+    return str(path)
+
+
+def send_twice(graph_url, image, recipient_id):
+    bot = Bot('token', graph_url=graph_url,
+              attachment_registry=AttachmentRegistry())
+    first = bot.send_image(recipient_id, image)
+    bot.send_image('ok', image)
+    return first
+
+
+@pytest.mark.parametrize('recipient_id', ['blocked', 'no_permission'])
+def test_recipient_errors_keep_attachment_id(attachment_graph, image,
+                                             recipient_id):
+    result = send_twice(attachment_graph.url, image, recipient_id)
+    assert result['error']['code'] == ERRORS[recipient_id]['code']
+    assert attachment_graph.uploads == 1
+
+
+@pytest.mark.parametrize('recipient_id', ['invalid', 'upload_failure'])
+def test_attachment_errors_upload_again(attachment_graph, image,
+                                        recipient_id):
+    send_twice(attachment_graph.url, image, recipient_id)
+    assert attachment_graph.uploads == 2
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from fake_graph import FakeGraph
+from fb import Bot
+
+
+class FlakyGraph(FakeGraph):
+    """Fake Graph API failing the first send to each of `flaky` with a
+    transient error.
+    """
+
+    def __init__(self, flaky):
+        super(FlakyGraph, self).__init__()
+        self.flaky = set(flaky)
+        self.attempts = []
+
+    def handle(self, method, path, params):
+        if method == 'POST' and path.endswith('me/messages'):
+            recipient = params.get('recipient') or {}
+            if not isinstance(recipient, dict):
+                recipient = json.loads(recipient)
+            self.attempts.append(recipient.get('id'))
+            if recipient.get('id') in self.flaky:
+                self.flaky.discard(recipient.get('id'))
+                return 500, {'error': {'message': 'Transient', 'code': 2}}
+        return super(FlakyGraph, self).handle(method, path, params)
+
+
+@pytest.fixture
+def flaky_graph():
+    with FlakyGraph(['1', '3']) as server:
+        yield server
+
+
+def payload(recipient_id):
+    return {'recipient': {'id': recipient_id},
+            'message': {'text': 'hola {0}'.format(recipient_id)}}
+
+
+def test_send_batch_retries_only_failed_items(flaky_graph):
+    bot = Bot('token', graph_url=flaky_graph.url)
+    results = bot.send_batch([payload(str(i)) for i in range(5)], backoff=0)
+    assert [result.get('recipient_id') for result in results] == [
+        '0', '1', '2', '3', '4']
+    assert sorted(flaky_graph.attempts) == [
+        '0', '1', '1', '2', '3', '3', '4']
+
+
+def test_send_batch_gives_up_after_max_attempts(flaky_graph):
+    flaky_graph.flaky = set(['2'])
+    bot = Bot('token', graph_url=flaky_graph.url)
+    results = bot.send_batch([payload('1'), payload('2')], max_attempts=1)
+    assert results[0]['recipient_id'] == '1'
+    assert results[1]['error']['code'] == 2
+    assert flaky_graph.attempts == ['1', '2']
+
+
+def test_batch_context_sends_in_order(graph):
+    bot = Bot('token', graph_url=graph.url)
+    with bot.batch() as batch:
+        first = batch.send_text_message('1', 'uno')
+        second = batch.send_text_message('2', 'dos')
+    assert (first, second) == (0, 1)
+    assert [result['recipient_id'] for result in batch.results] == ['1', '2']
+    assert [json.loads(sent['message'])['text']
+            for sent in graph.sent] == ['uno', 'dos']
@@ -0,0 +1,141 @@
+import threading
+import time
+
+from cache import MISSING, TTLCache
+
+THREADS = 8
+
+
+class DictBackend(object):
+    """In-memory stand-in for RedisBackend, `add` is SET NX."""
+
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.values.get(key, MISSING)
+
+    def set(self, key, value, ttl):
+        self.values[key] = value
+
+    def add(self, key, value, ttl):
+        with self._lock:
+            if key in self.values:
+                return False
+            self.values[key] = value
+            return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def wait_for(condition, timeout=5):
+    until = time.time() + timeout
+    while not condition():
+        assert time.time() < until, 'timed out'
+        time.sleep(0.01)
+
+
+def load_concurrently(cache, loader):
+    results = []
+    errors = []
+
+    def load():
+        try:
+            results.append(cache.get_or_load('key', loader))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=load) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_get_or_load_coalesces_concurrent_misses():
+    cache = TTLCache()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return 'value'
+
+    threads, results, errors = load_concurrently(cache, loader)
+    wait_for(lambda: cache.coalesced == THREADS - 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ['value'] * THREADS
+    assert not errors
+    assert cache.get_or_load('key', lambda: 'other') == 'value'
+
+
+def test_get_or_load_shares_loader_errors():
+    cache = TTLCache()
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        raise ValueError('upstream down')
+
+    threads, results, errors = load_concurrently(cache, loader)
+    wait_for(lambda: cache.coalesced == THREADS - 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert not results
+    assert len(errors) == THREADS
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert cache.get('key', MISSING) is MISSING
+
+
+def test_get_or_load_caches_none():
+    cache = TTLCache()
+    calls = []
+    assert cache.get_or_load('key', lambda: calls.append(1)) is None
+    assert cache.get_or_load('key', lambda: calls.append(1)) is None
+    assert len(calls) == 1
+
+
+def test_add_only_sets_missing_keys():
+    cache = TTLCache(ttl=0.05)
+    assert cache.add('key', 1)
+    assert not cache.add('key', 2)
+    assert cache.get('key') == 1
+    time.sleep(0.1)
+    assert cache.add('key', 3)
+    assert cache.get('key') == 3
+
+
+def test_add_is_atomic_across_threads():
+    cache = TTLCache()
+    added = []
+    start = threading.Event()
+
+    def add(value):
+        start.wait(5)
+        if cache.add('key', value):
+            added.append(value)
+
+    threads = [threading.Thread(target=add, args=(value,))
+               for value in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    assert len(added) == 1
+    assert cache.get('key') == added[0]
+
+
+def test_add_is_shared_through_backend():
+    backend = DictBackend()
+    first, second = TTLCache(backend=backend), TTLCache(backend=backend)
+    assert first.add('seen:mid:1', True)
+    assert not second.add('seen:mid:1', True)
+    first.delete('seen:mid:1')
+    assert TTLCache(backend=backend).add('seen:mid:1', True)
@@ -0,0 +1,80 @@
+import pytest
+
+from project.musixmatch import (
+    ENRICH, SEARCH, QuotaBudget, QuotaExceeded)
+
+
+class FakeRedis(object):
+    """The part of a redis client RedisWindow uses."""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def incrby(self, key, amount):
+        self.commands.append(('incrby', key, amount))
+
+    def expire(self, key, seconds):
+        self.commands.append(('expire', key, seconds))
+
+    def execute(self):
+        for command, key, value in self.commands:
+            if command == 'incrby':
+                self.client.values[key] = (
+                    int(self.client.values.get(key) or 0) + value)
+            else:
+                self.client.expires[key] = value
+
+
+class FakeBackend(object):
+    def __init__(self):
+        self.client = FakeRedis()
+        self.prefix = 'fbc:'
+
+
+def spend(budget, priority=SEARCH):
+    spent = 0
+    while True:
+        try:
+            budget.acquire(priority)
+        except QuotaExceeded:
+            return spent
+        spent += 1
+
+
+def test_per_process_budget_sheds_low_priority_first():
+    budget = QuotaBudget(['key'], 10, 3600)
+    assert spend(budget, ENRICH) == 7
+    assert spend(budget, SEARCH) == 3
+
+
+def test_workers_share_the_budget_through_the_backend():
+    backend = FakeBackend()
+    workers = [QuotaBudget(['key1', 'key2'], 10, 3600, backend=backend)
+               for _ in range(3)]
+    assert sum(spend(worker) for worker in workers) == 20
+    # A restarted worker still sees the spent quota
+    restarted = QuotaBudget(['key1', 'key2'], 10, 3600, backend=backend)
+    assert restarted.stats()['used'] == 20
+    with pytest.raises(QuotaExceeded):
+        restarted.acquire(SEARCH)
+
+
+def test_backend_keys_hide_api_keys_and_expire():
+    backend = FakeBackend()
+    budget = QuotaBudget(['secret-key'], 10, 3600, backend=backend)
+    budget.acquire(SEARCH)
+    assert all('secret-key' not in key for key in backend.client.values)
+    assert all(seconds > 3600 for seconds in backend.client.expires.values())
@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from project import db
+from project.models import Song
+from project.schema import upgrade_schema
+
+# Tables as created before songs.updated_at and the favorites index
+OLD_SCHEMA = """
+CREATE TABLE users (
+    recipient_id VARCHAR(18) PRIMARY KEY, first_name VARCHAR(64),
+    last_name VARCHAR(120), created_at DATETIME, last_connection DATETIME);
+CREATE TABLE songs (
+    track_id VARCHAR(18) PRIMARY KEY, track_name VARCHAR(120),
+    artist_name VARCHAR(120), searched_times INTEGER);
+CREATE TABLE favorites (
+    users_recipient_id VARCHAR(18) REFERENCES users (recipient_id),
+    songs_track_id VARCHAR(18) REFERENCES songs (track_id),
+    CONSTRAINT "UC_user_id_song_id" UNIQUE (
+        users_recipient_id, songs_track_id));
+INSERT INTO songs VALUES ('1', 'Canción', 'Artista', 3);
+"""
+
+
+@pytest.fixture
+def app(make_client, tmpdir):
+    connection = sqlite3.connect(str(tmpdir.join('test.db')))
+    connection.executescript(OLD_SCHEMA)
+    connection.close()
+    app = make_client().application
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def test_upgrade_adds_missing_columns_and_indexes(app):
+    with pytest.raises(OperationalError):
+        Song.query.get('1')
+    db.session.rollback()
+    with db.engine.begin() as connection:
+        added = upgrade_schema(connection)
+    assert 'songs.updated_at' in added
+    assert 'ix_favorites_song_id_user_id' in added
+    song = Song.query.get('1')
+    assert song.track_name == 'Canción' and song.updated_at is None
+    with db.engine.begin() as connection:
+        assert upgrade_schema(connection) == []
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from fake_musixmatch import FakeMusixmatch
+
+
+@pytest.fixture
+def musixmatch():
+    with FakeMusixmatch(results=30) as server:
+        yield server
+
+
+def search(client, text):
+    return client.post('/', data=json.dumps({'object': 'page', 'entry': [{
+        'messaging': [{'sender': {'id': '1'}, 'timestamp': 1,
+                       'message': {'mid': 'm1', 'text': text}}]}]}),
+        content_type='application/json')
+
+
+@pytest.mark.parametrize('page_size,elements', [(3, 4), (9, 10), (15, 10)])
+def test_results_fit_in_a_generic_template(make_client, graph, musixmatch,
+                                           page_size, elements):
+    client = make_client(SEARCH_PAGE_SIZE=page_size, SEARCH_LOCAL_MIN=0,
+                         MUSIXMATCH_API_URL=musixmatch.url)
+    assert search(client, 'buscar: amor').status_code == 200
+    templates = [sent['message']['attachment']['payload']
+                 for sent in graph.sent
+                 if 'attachment' in sent.get('message', {})]
+    assert len(templates[-1]['elements']) == elements
+    assert templates[-1]['elements'][-1]['title'] == 'Más resultados'
@@ -0,0 +1,109 @@
+import hashlib
+import hmac
+import io
+import json
+
+import pytest
+
+from fb import (
+    PayloadTooLarge, read_payload, read_signed_payload,
+    validate_hub_signature)
+from project import views
+
+SECRET = 'app-secret'
+BODY = json.dumps({'object': 'page', 'entry': [{'messaging': [
+    {'sender': {'id': '1'}, 'timestamp': 1,
+     'message': {'mid': 'm1', 'text': 'hola'}}]}]}).encode('utf-8')
+
+
+def sign(body, secret=SECRET, method='sha256'):
+    return '{0}={1}'.format(method, hmac.new(
+        secret.encode('utf-8'), body, getattr(hashlib, method)).hexdigest())
+
+
+@pytest.mark.parametrize('method', ['sha1', 'sha256'])
+def test_valid_signature(method):
+    assert validate_hub_signature(SECRET, BODY, sign(BODY, method=method))
+    assert read_signed_payload(SECRET, io.BytesIO(BODY),
+                               sign(BODY, method=method), 1024) == BODY
+
+
+@pytest.mark.parametrize('header', [
+    sign(BODY, secret='other-secret'),
+    sign(BODY + b' '),
+    sign(BODY, method='sha1').replace('sha1', 'sha256'),
+    'md5=' + hashlib.md5(BODY).hexdigest(),
+    'sha256',
+    '',
+    None,
+    'sha256=' + u'é' * 64,
+    'sha256=' + u'☃' * 64,
+])
+def test_forged_missing_and_malformed_signatures(header):
+    assert not validate_hub_signature(SECRET, BODY, header)
+    assert read_signed_payload(SECRET, io.BytesIO(BODY), header, 1024) is None
+
+
+def test_oversized_body_stops_reading():
+    stream = io.BytesIO(b'x' * 4096)
+    with pytest.raises(PayloadTooLarge):
+        read_signed_payload(SECRET, stream, sign(b'x' * 4096), 1024,
+                            chunk_size=256)
+    assert stream.tell() < 4096
+    with pytest.raises(PayloadTooLarge):
+        read_payload(io.BytesIO(b'x' * 4096), 1024, chunk_size=256)
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    messages = []
+    monkeypatch.setattr(views, 'handle_message', messages.append)
+    return messages
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client(APP_SECRET=SECRET, WEBHOOK_MAX_BODY=1024)
+
+
+def post(client, body, signature=None, **kwargs):
+    headers = {}
+    if signature is not None:
+        headers['X-Hub-Signature-256'] = signature
+    return client.post('/', data=body, headers=headers,
+                       content_type='application/json', **kwargs)
+
+
+def test_webhook_accepts_signed_delivery(client, handled):
+    assert post(client, BODY, sign(BODY)).status_code == 200
+    assert [message['message']['mid'] for message in handled] == ['m1']
+
+
+@pytest.mark.parametrize('signature', [
+    None,
+    sign(BODY, secret='other-secret'),
+    'sha256=' + u'é' * 64,
+])
+def test_webhook_rejects_bad_signatures(client, handled, signature):
+    assert post(client, BODY, signature).status_code == 403
+    assert handled == []
+
+
+def test_webhook_rejects_oversized_body(client, handled):
+    body = b'x' * 2048
+    assert post(client, body, sign(body)).status_code == 413
+    assert handled == []
+
+
+@pytest.mark.parametrize('app_secret', [SECRET, None])
+def test_webhook_limits_bodies_without_length(make_client, handled,
+                                               app_secret):
+    client = make_client(APP_SECRET=app_secret, WEBHOOK_MAX_BODY=1024)
+    body = b'x' * 2048
+    response = client.post('/', input_stream=io.BytesIO(body), headers={
+        'Content-Type': 'application/json',
+        'Transfer-Encoding': 'chunked',
+        'X-Hub-Signature-256': sign(body)},
+        environ_overrides={'wsgi.input_terminated': True})
+    assert response.status_code == 413
+    assert handled == []
@@ -0,0 +1,32 @@
+import pytest
+
+from project import db
+
+TRACK = {'track_name': 'Canción', 'artist_name': 'Artista'}
+
+
+@pytest.fixture
+def app(make_client):
+    app = make_client().application
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def test_saved_track_is_cached_after_commit(app):
+    track_store = app.extensions['fbc']['track_store']
+    track_store.save(1, None, TRACK)
+    assert not track_store.cached(1)
+    db.session.commit()
+    assert track_store.cached(1)
+    assert track_store.lookup(1) == (None, True)
+
+
+def test_rolled_back_track_is_not_cached(app):
+    track_store = app.extensions['fbc']['track_store']
+    track_store.save(2, None, TRACK)
+    db.session.rollback()
+    assert not track_store.cached(2)
+    track_store.save(2, None, TRACK)
+    db.session.commit()
+    assert track_store.cached(2)
@@ -0,0 +1,28 @@
+import pytest
+
+from fb import Bot, Transport
+
+
+@pytest.mark.parametrize('method,expected', [
+    ('GET', (3.0, 3.0)),
+    ('POST', (3.0, 10.0)),
+])
+def test_only_retried_reads_split_the_deadline(method, expected):
+    transport = Transport(max_retries=4, timeout=(3.05, 10))
+    assert transport.attempt_timeout(15, method=method) == expected
+
+
+def test_timeouts_without_deadline_are_kept():
+    transport = Transport(timeout=(3.05, 10))
+    assert transport.attempt_timeout(None, method='POST') == (3.05, 10)
+    assert transport.attempt_timeout(4, 2, 'POST') == (1, 2)
+
+
+def test_slow_send_within_the_deadline_succeeds(graph):
+    # Slower than a quarter of the deadline, which a POST cannot retry
+    graph.latency = 0.4
+    transport = Transport(max_retries=3, timeout=(3.05, 10),
+                          deadline=lambda: 1.0)
+    bot = Bot('token', transport=transport, graph_url=graph.url)
+    assert bot.send_text_message('1', 'hola')['recipient_id'] == '1'
+    assert graph.requests == 1
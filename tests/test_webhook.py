@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from project import views
+
+
+def delivery(*mids):
+    return json.dumps({'object': 'page', 'entry': [{'messaging': [
+        {'sender': {'id': '1'}, 'timestamp': 1,
+         'message': {'mid': mid, 'text': mid}} for mid in mids]}]})
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Texts handled by the webhook, the one of mid `fail` raises."""
+    texts = []
+
+    def handle_message(message):
+        if message['message']['mid'] == 'fail':
+            raise RuntimeError('handler failed')
+        texts.append(message['message']['text'])
+    monkeypatch.setattr(views, 'handle_message', handle_message)
+    return texts
+
+
+def post(client, *mids):
+    return client.post('/', data=delivery(*mids),
+                       content_type='application/json')
+
+
+def test_redelivery_is_dropped(client, handled):
+    assert post(client, 'a', 'b').status_code == 200
+    assert post(client, 'b', 'c').status_code == 200
+    assert handled == ['a', 'b', 'c']
+
+
+def test_failed_delivery_forgets_only_unfinished_events(client, handled):
+    with pytest.raises(RuntimeError):
+        post(client, 'a', 'fail', 'b')
+    assert handled == ['a']
+    assert post(client, 'a', 'b').status_code == 200
+    assert handled == ['a', 'b']
+
+
+def test_events_not_queued_are_forgotten(make_client, monkeypatch):
+    client = make_client(WEBHOOK_ASYNC=True)
+    event_queue = client.application.extensions['fbc']['event_queue']
+    queued = []
+
+    def enqueue_down(messages):
+        raise RuntimeError('database down')
+    monkeypatch.setattr(event_queue, 'enqueue', enqueue_down)
+    with pytest.raises(RuntimeError):
+        post(client, 'a', 'b')
+    monkeypatch.setattr(event_queue, 'enqueue', queued.extend)
+    assert post(client, 'a', 'b').status_code == 200
+    assert [message['message']['mid'] for message in queued] == ['a', 'b']
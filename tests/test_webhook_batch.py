@@ -0,0 +1,20 @@
+import json
+
+
+def delivery(*senders):
+    return json.dumps({'object': 'page', 'entry': [{'messaging': [
+        {'sender': {'id': sender}, 'timestamp': 1,
+         'postback': {'title': 'Chats hoy', 'payload': 'True'}}
+        for sender in senders]}]})
+
+
+def test_replies_slower_than_the_reserve_complete(make_client, graph):
+    # Each reply takes longer than the deadline left after REPLY_RESERVE
+    graph.latency = 0.4
+    client = make_client(WEBHOOK_BATCH=True, REQUEST_DEADLINE=2,
+                         REPLY_RESERVE=1.8)
+    response = client.post('/', data=delivery('1', '2'),
+                           content_type='application/json')
+    assert response.status_code == 200
+    assert sorted(sent['recipient']['id'] for sent in graph.sent) == [
+        '1', '2']